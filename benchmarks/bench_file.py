@@ -0,0 +1,40 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from copy import deepcopy
+
+import pytest
+
+from plugins import glovar
+from plugins.functions.file import save_thread
+
+
+@pytest.mark.parametrize("size", [1000, 10000, 100000])
+def bench_save_user_ids(benchmark, monkeypatch, size: int):
+    user_ids = {}
+
+    for i in range(size):
+        status = deepcopy(glovar.default_user_status)
+        status["join"] = {-1002000000000 - i % 50: 1512345678 + i}
+        status["score"]["nospam"] = (i % 7) / 2
+        status["total"] = status["score"]["nospam"]
+        user_ids[10000 + i] = status
+
+    monkeypatch.setattr(glovar, "user_ids", user_ids)
+
+    assert benchmark(save_thread, "user_ids") is True
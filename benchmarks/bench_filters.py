@@ -0,0 +1,91 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from telegram import Message
+
+from plugins import glovar
+from plugins.functions.filters import is_class_e_user, is_emoji, is_long_text, is_regex_text
+from plugins.functions.ids import init_group_id, rebuild_trusted_ids
+from tools.fake import get_message_update
+
+gid = -1002000000001
+
+texts = {
+    "plain": "This is a normal message about the weekend plans. " * 20,
+    "emoji": "Join now \U0001F4B0\U0001F4B0\U0001F525 free \U0001F381\U0001F381\U0001F381 " * 20
+}
+
+
+@pytest.fixture
+def group():
+    # A group that NOSPAM also manages, so is_long_text reaches the regex rules
+    init_group_id(gid)
+    glovar.admin_ids[gid] = {glovar.long_id, glovar.nospam_id}
+    glovar.configs[gid]["limit"] = 1000
+
+    return gid
+
+
+@pytest.fixture(params=[10, 100, 1000])
+def rules(request, monkeypatch):
+    # Rules that never match, so every one of them is searched twice
+    words = {f"(?# rule {i})spam{i:04d}(?:link|group)[a-z]{{2,8}}": 0 for i in range(request.param)}
+    monkeypatch.setattr(glovar, "del_words", words)
+
+    return request.param
+
+
+@pytest.fixture(params=[10, 1000, 10000])
+def trusted(request, monkeypatch):
+    # Many groups, each of them trusts a few users
+    trust_ids = {-1002000000000 - i: {10000 + i % 100} for i in range(request.param)}
+    monkeypatch.setattr(glovar, "trust_ids", trust_ids)
+    rebuild_trusted_ids()
+    yield request.param
+    monkeypatch.undo()
+    rebuild_trusted_ids()
+
+
+@pytest.mark.parametrize("uid, result", [(10000, True), (1, False)], ids=["trusted", "other"])
+def bench_is_class_e_user(benchmark, trusted, uid: int, result: bool):
+    assert benchmark(is_class_e_user, uid) is result
+
+
+@pytest.mark.parametrize("kind", list(texts))
+def bench_is_emoji(benchmark, kind: str):
+    benchmark(is_emoji, "ad", texts[kind])
+
+
+@pytest.mark.parametrize("kind", ["short", "limit", "long", "regex"])
+def bench_is_long_text(benchmark, group, rules, kind: str):
+    text = {
+        "short": "hello",
+        "limit": "a" * 900,
+        "long": "spam link t.me/example " * 500,
+        "regex": "spam link t.me/example " * 100
+    }[kind]
+    message = Message.de_json(get_message_update(1, group, 10000, text)["message"], None)
+    glovar.user_ids.pop(10000, None)
+
+    benchmark(is_long_text, message)
+
+
+def bench_is_regex_text(benchmark, rules):
+    text = "This is a normal message about the weekend plans. " * 20
+    assert benchmark(is_regex_text, "del", text) is None
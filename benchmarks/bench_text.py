@@ -0,0 +1,41 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from plugins import glovar
+from plugins.functions.etc import t2t
+
+texts = {
+    "ascii": "This is a normal message about the weekend plans. " * 20,
+    "cjk": "這是一條關於週末計劃的普通消息。" * 60,
+    "fancy": "Ｓｐａｍ \U0001d5cc\U0001d5c9\U0001d5ba\U0001d5c6 " * 100
+}
+
+
+@pytest.mark.parametrize("kind", list(texts))
+@pytest.mark.parametrize("normal, printable, zh_cn", [
+    (False, False, False),
+    (True, False, False),
+    (False, True, False),
+    (True, True, False),
+    (True, True, True)
+], ids=["raw", "normal", "printable", "both", "zh_cn"])
+def bench_t2t(benchmark, monkeypatch, kind: str, normal: bool, printable: bool, zh_cn: bool):
+    monkeypatch.setattr(glovar, "zh_cn", zh_cn)
+    benchmark(t2t, texts[kind], normal, printable)
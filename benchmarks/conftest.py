@@ -0,0 +1,160 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Micro-benchmarks of the hot paths, run from the repository root:
+#
+#     python -m pytest benchmarks
+#
+# The "benchmark" fixture comes from pytest-benchmark if it is installed,
+# otherwise a minimal timer with the same calling convention is used.
+#
+# Each run is saved as JSON in benchmarks/.results, named after the commit.
+# Compare two runs on the same machine with pytest-benchmark:
+#
+#     pytest-benchmark --storage file://benchmarks/.results compare 0001 0002
+#
+# The minimal timer prints the change against the previous saved run itself.
+
+import sys
+from glob import glob
+from json import dump, load
+from os import makedirs
+from os.path import abspath, basename, dirname, getmtime, join
+from subprocess import DEVNULL, check_output
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+here = dirname(abspath(__file__))
+sys.path.insert(0, dirname(here))
+
+from tools.fake import prepare  # noqa: E402
+
+# The plugins read config.ini from the working directory when they are imported
+prepare()
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+# Saved runs
+storage = join(here, ".results")
+
+# Results of the minimal timer
+results: List[Dict[str, float]] = []
+
+
+class Timer:
+    # A minimal stand-in for the pytest-benchmark fixture
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, target: Callable, *args, **kwargs):
+        # Calibrate the number of calls in a round
+        start = perf_counter()
+        result = target(*args, **kwargs)
+        once = perf_counter() - start
+        number = max(1, min(100000, int(0.01 / max(once, 1e-9))))
+        rounds = []
+
+        for _ in range(20):
+            start = perf_counter()
+
+            for _ in range(number):
+                target(*args, **kwargs)
+
+            rounds.append((perf_counter() - start) / number)
+
+        rounds.sort()
+        results.append({
+            "name": self.name,
+            "min": rounds[0],
+            "median": rounds[len(rounds) // 2],
+            "max": rounds[-1],
+            "rounds": len(rounds),
+            "calls": number
+        })
+
+        return result
+
+
+def get_commit() -> str:
+    # Get the current commit, runs are saved under its name
+    try:
+        return check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here, stderr=DEVNULL).decode().strip()
+    except Exception:
+        return "local"
+
+
+def get_previous(commit: str) -> Optional[Dict[str, Dict[str, float]]]:
+    # Get the latest saved run of another commit
+    paths = [path for path in glob(join(storage, "*.json")) if basename(path) != f"{commit}.json"]
+
+    if not paths:
+        return None
+
+    with open(max(paths, key=getmtime), "r") as f:
+        return {result["name"]: result for result in load(f)["benchmarks"]}
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # The working directory is changed by prepare(), keep pytest-benchmark's storage in the repository
+    if pytest_benchmark is None:
+        return
+
+    if not config.getoption("benchmark_json") and not config.getoption("benchmark_save"):
+        config.option.benchmark_autosave = True
+
+    if config.getoption("benchmark_storage").startswith("file://./"):
+        config.option.benchmark_storage = f"file://{storage}"
+
+
+if pytest_benchmark is None:
+    @pytest.fixture
+    def benchmark(request) -> Timer:
+        return Timer(request.node.name)
+
+    def pytest_terminal_summary(terminalreporter):
+        if not results:
+            return
+
+        commit = get_commit()
+        previous = get_previous(commit)
+        makedirs(storage, exist_ok=True)
+
+        with open(join(storage, f"{commit}.json"), "w") as f:
+            dump({"commit": commit, "benchmarks": results}, f, indent=4)
+
+        terminalreporter.section("benchmark (minimal timer)")
+
+        for result in results:
+            line = (f"{result['name']:<50} "
+                    f"min {result['min'] * 1e6:10.2f} us  "
+                    f"median {result['median'] * 1e6:10.2f} us  "
+                    f"max {result['max'] * 1e6:10.2f} us")
+            old = previous and previous.get(result["name"])
+
+            if old:
+                line += f"  {(result['median'] / max(old['median'], 1e-12) - 1) * 100:+7.1f}%"
+
+            terminalreporter.write_line(line)
+
+        terminalreporter.write_line(f"saved to {join(storage, commit + '.json')}")
@@ -23,10 +23,18 @@ import logging
 from random import randint
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from telegram.ext import Updater
 
 from plugins import glovar
-from plugins.functions.timers import backup_files, interval_min_10, reset_data, send_count, update_admins, update_status
+from plugins.functions.channel import flush_exchange
+from plugins.functions.filters import init_regex
+from plugins.functions.ids import rebuild_trusted_ids, rebuild_user_ids, rebuild_watch_heap
+from plugins.functions.metrics import init_metrics
+from plugins.functions.process import init_process
+from plugins.functions.route import init_routes, wait_slow_lane
+from plugins.functions.sampler import init_sampler
+from plugins.functions.session import get_updater, idle_updater, start_updater, stop_updater
+from plugins.functions.timers import backup_files, interval_min_10, reset_data, send_count, send_metrics
+from plugins.functions.timers import send_regex_reports, update_admins, update_status
 from plugins.handlers.command import add_command_handlers
 from plugins.handlers.error import add_error_handlers
 from plugins.handlers.message import add_message_handlers
@@ -34,34 +42,62 @@ from plugins.handlers.message import add_message_handlers
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Check the existing rules
+init_regex()
+
+# Fork the worker processes
+init_process()
+
+# Build the indexes
+rebuild_trusted_ids()
+rebuild_user_ids()
+rebuild_watch_heap()
+
 # Config session
-updater = Updater(
-    token=glovar.bot_token,
-    request_kwargs=glovar.request_kwargs,
-    use_context=True
-)
-updater.start_polling()
+updater = get_updater()
+start_updater(updater)
 
 # Register handlers
+init_routes()
 add_command_handlers(updater.dispatcher)
 add_message_handlers(updater.dispatcher)
 add_error_handlers(updater.dispatcher)
 
-# Send online status
-update_status(updater.bot, "online")
+# Instrument the handlers
+init_metrics(updater.dispatcher)
+
+# Sample the stacks on SIGUSR1
+init_sampler(updater.bot)
+
+# Send online status, only the first shard reports the status
+if not glovar.shard_index:
+    update_status(updater.bot, "online")
 
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
 scheduler.add_job(interval_min_10, "interval", minutes=10)
-scheduler.add_job(update_status, "cron", [updater.bot, "awake"], minute=randint(30, 34), second=randint(0, 59))
-scheduler.add_job(backup_files, "cron", [updater.bot], hour=20)
-scheduler.add_job(send_count, "cron", [updater.bot], hour=21)
 scheduler.add_job(reset_data, "cron", [updater.bot], day=glovar.date_reset, hour=22)
 scheduler.add_job(update_admins, "cron", [updater.bot], hour=22, minute=30)
+
+# The jobs that are once per bot run on the first shard
+if not glovar.shard_index:
+    scheduler.add_job(backup_files, "cron", [updater.bot], hour=20)
+    scheduler.add_job(send_count, "cron", [updater.bot], hour=21)
+    scheduler.add_job(update_status, "cron", [updater.bot, "awake"], minute=randint(30, 34), second=randint(0, 59))
+
+if glovar.metrics and glovar.metrics_report:
+    scheduler.add_job(send_metrics, "interval", [updater.bot], minutes=glovar.metrics_report)
+
+if glovar.regex_guard:
+    scheduler.add_job(send_regex_reports, "interval", [updater.bot], minutes=1)
+
 scheduler.start()
 
 # Hold
-updater.idle()
+idle_updater()
 
-# Stop
-updater.stop()
+# Stop, finish the updates in flight and the slow routes, then share the batches that are still waiting
+scheduler.shutdown()
+stop_updater(updater)
+wait_slow_lane()
+flush_exchange(updater.bot)
@@ -18,13 +18,15 @@
 
 import logging
 from json import dumps
-from typing import List, Optional, Union
+from typing import Any, List, Optional, Tuple, Union
 
 from telegram import Bot, Chat, Message
 
 from .. import glovar
-from .etc import code, code_block, general_link, get_forward_name, get_full_name, lang, message_link, thread
+from .etc import code, code_block, delay, general_link, get_forward_name, get_full_name, lang, message_link, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, save
+from .ids import add_declared_message_id, update_user_score
+from .shard import sync_shards, synced
 from .telegram import get_group_info, send_document, send_message
 
 # Enable logging
@@ -64,8 +66,8 @@ def ask_for_help(client: Bot, level: str, gid: int, uid: int, group: str = "sing
 def declare_message(client: Bot, gid: int, mid: int) -> bool:
     # Declare a message
     try:
-        glovar.declared_message_ids[gid].add(mid)
-        share_data(
+        add_declared_message_id(gid, mid)
+        share_batch_data(
             client=client,
             receivers=glovar.receivers["declare"],
             action="update",
@@ -73,7 +75,8 @@ def declare_message(client: Bot, gid: int, mid: int) -> bool:
             data={
                 "group_id": gid,
                 "message_id": mid
-            }
+            },
+            key=(gid, mid)
         )
 
         return True
@@ -108,8 +111,62 @@ def exchange_to_hide(client: Bot) -> bool:
     return False
 
 
+def flush_batch_data(client: Bot, batch_key: Tuple[Tuple[str, ...], str, str]) -> bool:
+    # Share the collected data of a batch
+    try:
+        with glovar.locks["exchange"]:
+            batch = glovar.exchange_batch.pop(batch_key, {})
+
+        if not batch:
+            return True
+
+        receivers, action, action_type = batch_key
+        data_list = list(batch.values())
+
+        # Keep the original format for a single item
+        if len(data_list) == 1:
+            share_data_thread(client, list(receivers), action, action_type, data_list[0])
+            return True
+
+        # Split the batch into parts that fit in a message
+        part = []
+        length = 0
+
+        for data in data_list:
+            size = len(dumps(data, indent=4)) + 12
+
+            if part and length + size > glovar.batch_limit:
+                share_data_thread(client, list(receivers), action, action_type, part)
+                part = []
+                length = 0
+
+            part.append(data)
+            length += size
+
+        part and share_data_thread(client, list(receivers), action, action_type, part)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Flush batch data error: {e}", exc_info=True)
+
+    return False
+
+
+def flush_exchange(client: Bot) -> bool:
+    # Share all the batches that are still waiting
+    try:
+        for batch_key in list(glovar.exchange_batch):
+            flush_batch_data(client, batch_key)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Flush exchange error: {e}", exc_info=True)
+
+    return False
+
+
 def format_data(sender: str, receivers: List[str], action: str, action_type: str,
-                data: Union[bool, dict, int, str] = None) -> str:
+                data: Union[bool, dict, int, list, str] = None) -> str:
     # See https://scp-079.org/exchange/
     text = ""
     try:
@@ -256,7 +313,7 @@ def send_debug(client: Bot, chat: Chat, action: str, uid: int, mid: int, em: Mes
 def share_bad_user(client: Bot, uid: int) -> bool:
     # Share a bad user with other bots
     try:
-        share_data(
+        share_batch_data(
             client=client,
             receivers=glovar.receivers["bad"],
             action="add",
@@ -264,7 +321,8 @@ def share_bad_user(client: Bot, uid: int) -> bool:
             data={
                 "id": uid,
                 "type": "user"
-            }
+            },
+            key=uid
         )
 
         return True
@@ -274,8 +332,34 @@ def share_bad_user(client: Bot, uid: int) -> bool:
     return False
 
 
+def share_batch_data(client: Bot, receivers: List[str], action: str, action_type: str, data: dict,
+                     key: Any) -> bool:
+    # Collect the data in a short window, the last data of the same key wins
+    try:
+        if not glovar.batch_window:
+            return share_data(client, receivers, action, action_type, data)
+
+        batch_key = (tuple(receivers), action, action_type)
+
+        with glovar.locks["exchange"]:
+            batch = glovar.exchange_batch.get(batch_key)
+
+            if batch is None:
+                batch = glovar.exchange_batch[batch_key] = {}
+                delay(glovar.batch_window, flush_batch_data, [client, batch_key])
+
+            batch.pop(key, None)
+            batch[key] = data
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share batch data error: {e}", exc_info=True)
+
+    return False
+
+
 def share_data(client: Bot, receivers: List[str], action: str, action_type: str,
-               data: Union[bool, dict, int, str] = None, file: str = None, encrypt: bool = True) -> bool:
+               data: Union[bool, dict, int, list, str] = None, file: str = None, encrypt: bool = True) -> bool:
     # Use this function to share data in the channel
     try:
         thread(
@@ -291,9 +375,13 @@ def share_data(client: Bot, receivers: List[str], action: str, action_type: str,
 
 
 def share_data_thread(client: Bot, receivers: List[str], action: str, action_type: str,
-                      data: Union[bool, dict, int, str] = None, file: str = None, encrypt: bool = True) -> bool:
+                      data: Union[bool, dict, int, list, str] = None, file: str = None, encrypt: bool = True) -> bool:
     # Share data thread
     try:
+        # The other shards keep the same user data, only the data with a LONG route is relayed
+        if glovar.shard_count and not file and (action, action_type) in synced:
+            sync_shards(action, action_type, data)
+
         if glovar.sender in receivers:
             receivers.remove(glovar.sender)
 
@@ -377,10 +465,48 @@ def share_regex_count(client: Bot, word_type: str) -> bool:
     return False
 
 
+def share_regex_profile(client: Bot, word_type: str) -> bool:
+    # Use this function to share the slowest rules of the word type to REGEX
+    try:
+        stats = glovar.regex_stats.get(word_type)
+
+        if not stats:
+            return True
+
+        rules = sorted(stats.items(), key=lambda x: x[1]["max"], reverse=True)[:glovar.regex_top]
+        data = [
+            {
+                "word": word,
+                "count": rule["count"],
+                "time": rule["time"],
+                "average": rule["time"] / rule["count"],
+                "max": rule["max"],
+                "input": rule["input"],
+                "length": rule["length"]
+            }
+            for word, rule in rules
+        ]
+        file = data_to_file(data)
+        share_data(
+            client=client,
+            receivers=["REGEX"],
+            action="regex",
+            action_type="profile",
+            data=f"{word_type}_words",
+            file=file
+        )
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share regex profile error: {e}", exc_info=True)
+
+    return False
+
+
 def share_watch_user(client: Bot, the_type: str, uid: int, until: str) -> bool:
     # Share a watch ban user with other bots
     try:
-        share_data(
+        share_batch_data(
             client=client,
             receivers=glovar.receivers["watch"],
             action="add",
@@ -389,7 +515,8 @@ def share_watch_user(client: Bot, the_type: str, uid: int, until: str) -> bool:
                 "id": uid,
                 "type": the_type,
                 "until": until
-            }
+            },
+            key=(uid, the_type)
         )
 
         return True
@@ -404,9 +531,9 @@ def update_score(client: Bot, uid: int) -> bool:
     try:
         count = len(glovar.user_ids[uid]["detected"])
         score = count * 0.6
-        glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
+        update_user_score(uid, glovar.sender.lower(), score)
         save("user_ids")
-        share_data(
+        share_batch_data(
             client=client,
             receivers=glovar.receivers["score"],
             action="update",
@@ -414,7 +541,8 @@ def update_score(client: Bot, uid: int) -> bool:
             data={
                 "id": uid,
                 "score": round(score, 1)
-            }
+            },
+            key=uid
         )
 
         return True
@@ -32,6 +32,7 @@ from opencc import convert
 from telegram import Message, User
 
 from .. import glovar
+from .loop import submit
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -368,6 +369,10 @@ def t2t(text: str, normal: bool, printable: bool) -> str:
 def thread(target: Callable, args: tuple) -> bool:
     # Call a function using thread
     try:
+        # Send Telegram calls as coroutines in the async mode
+        if glovar.async_enabled and submit(target, args):
+            return True
+
         t = Thread(target=target, args=args)
         t.daemon = True
         t.start()
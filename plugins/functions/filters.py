@@ -19,16 +19,29 @@
 import logging
 import re
 from copy import deepcopy
+from hashlib import sha256
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from time import time
+from typing import Dict, Iterable, List, Match, Optional, Tuple, Union
 
 from telegram import Message, User
 from telegram.ext import BaseFilter
 
 from .. import glovar
-from .etc import get_now, get_int, get_forward_name, get_full_name, get_text
+from .etc import get_now, get_int, get_forward_name, get_full_name, get_text, t2t
 from .file import save
-from .ids import init_group_id
+from .ids import get_join_count, init_group_id
+from .process import broadcast, run_job
+
+try:
+    import regex
+except ImportError:
+    regex = None
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -249,6 +262,174 @@ new_group = FilterNewGroup()
 test_group = FilterTestGroup()
 
 
+def check_regex(word_type: str, words: Iterable[str]) -> bool:
+    # Check the rules, an invalid rule is never used, a complex rule is reported, the regex lock must be held
+    try:
+        for word in words:
+            issue = get_regex_issue(word)
+
+            if issue == "invalid":
+                quarantine_regex(word_type, word, issue)
+            elif issue:
+                glovar.regex_reports.append((word_type, word, issue))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Check regex error: {e}", exc_info=True)
+
+    return False
+
+
+def count_long_stage(stage: str) -> bool:
+    # Count the stage where the long text check stopped, always return True
+    try:
+        glovar.long_stats[stage] = glovar.long_stats.get(stage, 0) + 1
+    except Exception as e:
+        logger.warning(f"Count long stage error: {e}", exc_info=True)
+
+    return True
+
+
+def count_regex(word_type: str, times: List[Tuple[str, float]], text: str) -> bool:
+    # Count the time each rule took on the text, keep the hash of the slowest input of each rule
+    try:
+        if glovar.process_hits is not None:
+            glovar.process_hits.append(("count_regex", (word_type, times, text)))
+            return True
+
+        digest = ""
+
+        with glovar.locks["regex"]:
+            stats = glovar.regex_stats.setdefault(word_type, {})
+
+            for word, secs in times:
+                rule = stats.get(word)
+
+                if rule is None:
+                    rule = stats[word] = {
+                        "count": 0,
+                        "time": 0.0,
+                        "max": 0.0,
+                        "input": "",
+                        "length": 0
+                    }
+
+                rule["count"] += 1
+                rule["time"] += secs
+
+                if secs <= rule["max"]:
+                    continue
+
+                digest = digest or sha256(text.encode("utf-8", "surrogatepass")).hexdigest()[:16]
+                rule["max"] = secs
+                rule["input"] = digest
+                rule["length"] = len(text)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Count regex error: {e}", exc_info=True)
+
+    return False
+
+
+def count_word(word_type: str, word: str) -> bool:
+    # Count the rule's hit, a worker process leaves the counting to the main process
+    try:
+        if glovar.process_hits is not None:
+            glovar.process_hits.append(("count_word", (word_type, word)))
+            return True
+
+        words = eval(f"glovar.{word_type}_words")
+
+        if word not in words:
+            return True
+
+        words[word] = words.get(word, 0) + 1
+        save(f"{word_type}_words")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Count word error: {e}", exc_info=True)
+
+    return False
+
+
+def get_long_stage(text: str, name: str, forward_name: str, nospam: bool) -> str:
+    # Get the stage where the check of the long text stops, the CPU-bound part that may run in a worker process
+    result = "passed"
+    try:
+        # Check the forward from name and the user's name
+        if is_nm_name(forward_name) or is_nm_name(name):
+            return "name"
+
+        if not nospam:
+            return "nospam"
+
+        # Check the text
+        normal_text = t2t(text, True, True)
+
+        if is_ban_text(normal_text, False) or is_regex_text("del", normal_text):
+            return "regex"
+    except Exception as e:
+        logger.warning(f"Get long stage error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_issue(word: str) -> str:
+    # Get the issue of the rule: invalid, complex for nested repeats that may backtrack exponentially, or empty
+    result = ""
+    try:
+        try:
+            pattern = sre_parse.parse(word, re.I | re.S | re.M)
+        except (re.error, RecursionError):
+            return "invalid"
+
+        if get_repeat_depth(pattern) >= 2:
+            result = "complex"
+    except Exception as e:
+        logger.warning(f"Get regex issue error: {e}", exc_info=True)
+
+    return result
+
+
+def get_repeat_depth(value) -> int:
+    # Get the depth of the nested repeats whose max is greater than 1
+    result = 0
+    try:
+        if isinstance(value, sre_parse.SubPattern):
+            for op, av in value:
+                if op in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}:
+                    _, high, sub = av
+                    result = max(result, get_repeat_depth(sub) + (high > 1))
+                else:
+                    result = max(result, get_repeat_depth(av))
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                result = max(result, get_repeat_depth(item))
+    except Exception as e:
+        logger.warning(f"Get repeat depth error: {e}", exc_info=True)
+
+    return result
+
+
+def init_regex() -> bool:
+    # Check the existing rules when the guard is on
+    try:
+        if not glovar.regex_guard:
+            return True
+
+        with glovar.locks["regex"]:
+            for word_type in glovar.regex:
+                check_regex(word_type, list(eval(f"glovar.{word_type}_words")))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init regex error: {e}", exc_info=True)
+
+    return False
+
+
 def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
     # Check if the text is ad text
     try:
@@ -373,11 +554,8 @@ def is_class_e_user(user: Union[int, User]) -> bool:
         if uid in glovar.bot_ids:
             return True
 
-        group_list = list(glovar.trust_ids)
-
-        for gid in group_list:
-            if uid in glovar.trust_ids.get(gid, set()):
-                return True
+        if glovar.trusted_ids.get(uid):
+            return True
     except Exception as e:
         logger.warning(f"Is class e user error: {e}", exc_info=True)
 
@@ -416,7 +594,7 @@ def is_declared_message(message: Message) -> bool:
 def is_declared_message_id(gid: int, mid: int) -> bool:
     # Check if the message's ID is declared by other bots
     try:
-        if mid in glovar.declared_message_ids.get(gid, set()):
+        if mid in glovar.declared_message_ids.get(gid, {}):
             return True
     except Exception as e:
         logger.warning(f"Is declared message id error: {e}", exc_info=True)
@@ -514,7 +692,11 @@ def is_high_score_user(user: User) -> float:
         if not user_status:
             return 0.0
 
-        score = sum(user_status["score"].values())
+        score = user_status["total"]
+
+        # Self-check the cached total score
+        if glovar.debug and abs(score - sum(user_status["score"].values())) > 0.01:
+            logger.warning(f"User {uid} total score {score} is inconsistent with {user_status['score']}")
 
         if score >= 3.0:
             return score
@@ -550,10 +732,7 @@ def is_limited_user(gid: int, user: User, now: int, short: bool = True) -> bool:
         if short and now - join < glovar.time_short:
             return True
 
-        track = [gid for gid in glovar.user_ids[uid]["join"]
-                 if now - glovar.user_ids[uid]["join"][gid] < glovar.time_track]
-
-        if len(track) >= glovar.limit_track:
+        if get_join_count(uid, now, glovar.time_track) >= glovar.limit_track:
             return True
     except Exception as e:
         logger.warning(f"Is limited user error: {e}", exc_info=True)
@@ -562,7 +741,7 @@ def is_limited_user(gid: int, user: User, now: int, short: bool = True) -> bool:
 
 
 def is_long_text(message: Message) -> int:
-    # Check if the text is super long
+    # Check if the text is super long, the cheapest checks come first
     try:
         if not message.chat:
             return 0
@@ -574,44 +753,40 @@ def is_long_text(message: Message) -> int:
         text = get_text(message)
 
         if not text.strip():
-            return 0
+            return count_long_stage("empty") and 0
 
         # If the user is being punished
         if is_detected_user(message):
-            return 79
+            return count_long_stage("detected") and 79
+
+        # A UTF-8 character takes at most 4 bytes, skip the short text without encoding it
+        limit = glovar.configs[gid]["limit"]
+
+        if len(text) * 4 < limit:
+            return count_long_stage("bound") and 0
 
         # Get length
         length = len(text.encode())
 
         # Check limit
-        if length < glovar.configs[gid]["limit"]:
-            return 0
+        if length < limit:
+            return count_long_stage("limit") and 0
 
-        # Work with NOSPAM
-        if length <= 10000:
-            # Check the forward from name:
-            forward_name = get_forward_name(message, True, True)
+        # Work with NOSPAM, the super long text is left to it
+        if length > 10000:
+            return count_long_stage("long") and 0
 
-            if is_nm_text(forward_name):
-                return 0
+        # Check the names and the rules, in a worker process if there are any
+        nospam = glovar.nospam_id in glovar.admin_ids[gid]
+        args = (text, get_full_name(message.from_user), get_forward_name(message), nospam)
+        stage, hits = run_job(get_long_stage, args, "timeout")
+        replay_hits(hits)
 
-            # Check the user's name:
-            name = get_full_name(message.from_user, True, True)
+        # A worker ran out of time, the guarded rules are bounded here, otherwise the text is left alone
+        if stage == "timeout" and glovar.regex_guard:
+            stage = get_long_stage(*args)
 
-            if is_nm_text(name):
-                return 0
-
-            # Check the text
-            normal_text = get_text(message, True, True)
-
-            if glovar.nospam_id in glovar.admin_ids[gid]:
-                if is_ban_text(normal_text, False):
-                    return 0
-
-                if is_regex_text("del", normal_text):
-                    return 0
-
-            return length
+        return count_long_stage(stage) and (stage in {"nospam", "passed"} and length) or 0
     except Exception as e:
         logger.warning(f"Is long text error: {e}", exc_info=True)
 
@@ -640,18 +815,39 @@ def is_new_user(user: User, now: int, gid: int = 0, joined: bool = False) -> boo
 
             if now - join < glovar.time_new:
                 return True
-        else:
-            for gid in list(glovar.user_ids[uid]["join"]):
-                join = glovar.user_ids[uid]["join"].get(gid, 0)
-
-                if now - join < glovar.time_new:
-                    return True
+        elif get_join_count(uid, now, glovar.time_new):
+            return True
     except Exception as e:
         logger.warning(f"Is new user error: {e}", exc_info=True)
 
     return False
 
 
+def is_nm_name(name: str) -> bool:
+    # Check if the name is nm text, the verdict is cached by the raw name
+    try:
+        if not name:
+            return False
+
+        result = glovar.names.get(name)
+
+        if result is not None:
+            return result
+
+        result = is_nm_text(t2t(name, True, True))
+
+        if len(glovar.names) >= glovar.limit_name:
+            glovar.names.clear()
+
+        glovar.names[name] = result
+
+        return result
+    except Exception as e:
+        logger.warning(f"Is nm name error: {e}", exc_info=True)
+
+    return False
+
+
 def is_nm_text(text: str) -> bool:
     # Check if the text is nm text
     try:
@@ -665,6 +861,25 @@ def is_nm_text(text: str) -> bool:
     return False
 
 
+def is_recorded_user(gid: int, uid: int, now: int) -> bool:
+    # Check if the user's evidence has been forwarded recently
+    try:
+        recorded = glovar.recorded_ids.get(gid, {})
+        the_time = recorded.get(uid)
+
+        if the_time is None:
+            return False
+
+        if now - the_time < glovar.time_recorded:
+            return True
+
+        recorded.pop(uid, None)
+    except Exception as e:
+        logger.warning(f"Is recorded user error: {e}", exc_info=True)
+
+    return False
+
+
 def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
     # Check if the text hit the regex rules
     result = None
@@ -681,21 +896,36 @@ def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = Fa
 
         with glovar.locks["regex"]:
             words = list(eval(f"glovar.{word_type}_words"))
+            quarantine = glovar.regex_quarantine.get(word_type, set())
+
+        # Time each rule in the profiling mode
+        times = glovar.regex_profile and []
 
         for word in words:
             if ocr and "(?# nocr)" in word:
                 continue
 
-            result = re.search(word, text, re.I | re.S | re.M)
+            if word in quarantine:
+                continue
+
+            start = times is not False and time()
+
+            if glovar.regex_guard:
+                result = search_regex(word_type, word, text)
+            else:
+                result = re.search(word, text, re.I | re.S | re.M)
+
+            if times is not False:
+                times.append((word, time() - start))
 
             # Count and return
             if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
+                times and count_regex(word_type, times, text)
+                count_word(word_type, word)
                 return result
 
+        times and count_regex(word_type, times, text)
+
         # Try again
         return is_regex_text(word_type, text, ocr, True)
     except Exception as e:
@@ -739,3 +969,111 @@ def is_wb_text(text: str, ocr: bool) -> bool:
         logger.warning(f"Is wb text error: {e}", exc_info=True)
 
     return False
+
+
+def quarantine_regex(word_type: str, word: str, reason: str) -> bool:
+    # Stop using the rule and report it, the regex lock must be held by the caller
+    try:
+        if word in glovar.regex_quarantine.setdefault(word_type, set()):
+            return True
+
+        glovar.regex_quarantine[word_type].add(word)
+        glovar.regex_reports.append((word_type, word, reason))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Quarantine regex error: {e}", exc_info=True)
+
+    return False
+
+
+def replay_hits(hits: List[Tuple[str, tuple]]) -> bool:
+    # Replay the counting of a worker process in the main process
+    try:
+        targets = {
+            "count_regex": count_regex,
+            "count_word": count_word,
+            "strike_regex": strike_regex
+        }
+
+        for name, args in hits:
+            targets[name](*args)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Replay hits error: {e}", exc_info=True)
+
+    return False
+
+
+def search_regex(word_type: str, word: str, text: str) -> Optional[Match]:
+    # Search with the time budget, the regex module stops the search as soon as it runs over
+    result = None
+    try:
+        result = regex.search(word, text, regex.I | regex.S | regex.M | regex.V0, timeout=glovar.regex_budget)
+    except TimeoutError:
+        strike_regex(word_type, word)
+    except Exception as e:
+        logger.warning(f"Search regex error: {e}", exc_info=True)
+
+    return result
+
+
+def share_words(word_type: str) -> bool:
+    # Send the rules of the word type to the worker processes, the regex lock must be held by the caller
+    try:
+        if not glovar.process_workers:
+            return True
+
+        quarantine = glovar.regex_quarantine.get(word_type, set())
+        words = [word for word in eval(f"glovar.{word_type}_words") if word not in quarantine]
+        special = (word_type in {"spc", "spe"} and eval(f"glovar.{word_type}_dict")) or None
+        broadcast(update_words, (word_type, words, special))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share words error: {e}", exc_info=True)
+
+    return False
+
+
+def strike_regex(word_type: str, word: str) -> bool:
+    # Count the rule's search that ran over the budget, quarantine the rule after too many strikes
+    try:
+        if glovar.process_hits is not None:
+            glovar.process_hits.append(("strike_regex", (word_type, word)))
+            return True
+
+        with glovar.locks["regex"]:
+            if word not in eval(f"glovar.{word_type}_words"):
+                return True
+
+            timeouts = glovar.regex_timeouts.setdefault(word_type, {})
+            timeouts[word] = timeouts.get(word, 0) + 1
+
+            if timeouts[word] < glovar.regex_strikes:
+                return True
+
+            quarantine_regex(word_type, word, "timeout")
+            share_words(word_type)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Strike regex error: {e}", exc_info=True)
+
+    return False
+
+
+def update_words(word_type: str, words: List[str], special: Optional[Dict[str, str]]) -> bool:
+    # Replace the rules of the word type, run in the worker processes
+    try:
+        with glovar.locks["regex"]:
+            exec(f"glovar.{word_type}_words = dict.fromkeys(words, 0)")
+            special is not None and exec(f"glovar.{word_type}_dict = special")
+            glovar.names = {}
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update words error: {e}", exc_info=True)
+
+    return False
@@ -23,6 +23,8 @@ from telegram import Bot
 from .. import glovar
 from .etc import code, lang, thread
 from .file import save
+from .ids import remove_trust_ids
+from .shard import sync_trust
 from .telegram import leave_chat
 
 # Enable logging
@@ -59,14 +61,16 @@ def leave_group(client: Bot, gid: int) -> bool:
         glovar.admin_ids.pop(gid, None)
         save("admin_ids")
 
-        glovar.trust_ids.pop(gid, set())
+        remove_trust_ids(gid)
         save("trust_ids")
+        sync_trust([gid])
 
         glovar.configs.pop(gid, None)
         save("configs")
 
-        glovar.declared_message_ids.pop(gid, set())
-        glovar.recorded_ids.pop(gid, set())
+        glovar.chats.pop(gid, None)
+        glovar.declared_message_ids.pop(gid, {})
+        glovar.recorded_ids.pop(gid, {})
 
         return True
     except Exception as e:
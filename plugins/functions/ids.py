@@ -18,6 +18,9 @@
 
 import logging
 from copy import deepcopy
+from heapq import heapify, heappop, heappush
+from time import time
+from typing import Set
 
 from .. import glovar
 from .file import save
@@ -26,6 +29,101 @@ from .file import save
 logger = logging.getLogger(__name__)
 
 
+def add_declared_message_id(gid: int, mid: int) -> bool:
+    # Add a declared message's id, drop the expired or excess ones
+    try:
+        declared = glovar.declared_message_ids.get(gid)
+
+        if declared is None:
+            return False
+
+        now = int(time())
+        declared.pop(mid, None)
+        declared[mid] = now
+
+        while declared and len(declared) > glovar.limit_declare:
+            declared.pop(next(iter(declared)), None)
+
+        prune_declared_message_ids(gid, now)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add declared message id error: {e}", exc_info=True)
+
+    return False
+
+
+def add_join_id(gid: int, uid: int, now: int) -> bool:
+    # Record a user's join time, keep the join history sorted by time and within the window
+    try:
+        join = glovar.user_ids.get(uid, {}).get("join")
+
+        if join is None:
+            return False
+
+        join.pop(gid, None)
+        join[gid] = now
+        prune_join_ids(uid, now)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add join id error: {e}", exc_info=True)
+
+    return False
+
+
+def add_recorded_id(gid: int, uid: int, now: int) -> bool:
+    # Record a user whose evidence is forwarded, the window starts from now
+    try:
+        recorded = glovar.recorded_ids.get(gid)
+
+        if recorded is None:
+            return False
+
+        recorded.pop(uid, None)
+        recorded[uid] = now
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add recorded id error: {e}", exc_info=True)
+
+    return False
+
+
+def add_watch_id(the_type: str, uid: int, until: int) -> bool:
+    # Add a watch user, its expiry time is pushed to the heap
+    glovar.locks["watch"].acquire()
+    try:
+        glovar.watch_ids[the_type][uid] = until
+        isinstance(until, int) and heappush(glovar.watch_heap, (until, the_type, uid))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add watch id error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return False
+
+
+def get_join_count(uid: int, now: int, secs: int) -> int:
+    # Count the groups the user joined in the last secs, the oldest joins come first
+    result = 0
+    try:
+        join = glovar.user_ids.get(uid, {}).get("join", {})
+        result = len(join)
+
+        for the_time in join.values():
+            if now - the_time < secs:
+                break
+
+            result -= 1
+    except Exception as e:
+        logger.warning(f"Get join count error: {e}", exc_info=True)
+
+    return result
+
+
 def init_group_id(gid: int) -> bool:
     # Init group data
     try:
@@ -51,10 +149,10 @@ def init_group_id(gid: int) -> bool:
             save("configs")
 
         if glovar.declared_message_ids.get(gid) is None:
-            glovar.declared_message_ids[gid] = set()
+            glovar.declared_message_ids[gid] = {}
 
         if glovar.recorded_ids.get(gid) is None:
-            glovar.recorded_ids[gid] = set()
+            glovar.recorded_ids[gid] = {}
 
         return True
     except Exception as e:
@@ -75,3 +173,224 @@ def init_user_id(uid: int) -> bool:
         logger.warning(f"Init user id {uid} error: {e}", exc_info=True)
 
     return False
+
+
+def prune_declared_message_ids(gid: int, now: int = 0) -> bool:
+    # Drop the expired declared message ids of a group, the oldest ones come first
+    try:
+        declared = glovar.declared_message_ids.get(gid)
+
+        if not declared:
+            return True
+
+        now = now or int(time())
+
+        while declared:
+            mid = next(iter(declared))
+
+            if now - declared.get(mid, now) <= glovar.time_declare:
+                break
+
+            declared.pop(mid, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Prune declared message ids error: {e}", exc_info=True)
+
+    return False
+
+
+def prune_join_ids(uid: int, now: int) -> bool:
+    # Drop the joins out of the window, the latest join is always kept
+    try:
+        join = glovar.user_ids.get(uid, {}).get("join")
+
+        while join and len(join) > glovar.limit_join:
+            join.pop(next(iter(join)), None)
+
+        while join and len(join) > 1:
+            gid = next(iter(join))
+
+            if now - join.get(gid, now) < glovar.time_join:
+                break
+
+            join.pop(gid, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Prune join ids error: {e}", exc_info=True)
+
+    return False
+
+
+def prune_recorded_ids(gid: int, now: int = 0) -> bool:
+    # Drop the expired recorded users of a group, the oldest ones come first
+    try:
+        recorded = glovar.recorded_ids.get(gid)
+
+        if not recorded:
+            return True
+
+        now = now or int(time())
+
+        while recorded:
+            uid = next(iter(recorded))
+
+            if now - recorded.get(uid, now) < glovar.time_recorded:
+                break
+
+            recorded.pop(uid, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Prune recorded ids error: {e}", exc_info=True)
+
+    return False
+
+
+def purge_watch_ids(now: int = 0) -> int:
+    # Remove the expired watch users, return the number of removed users
+    result = 0
+
+    glovar.locks["watch"].acquire()
+    try:
+        now = now or int(time())
+        heap = glovar.watch_heap
+
+        while heap and heap[0][0] <= now:
+            until, the_type, uid = heappop(heap)
+
+            # Skip the renewed or removed users
+            if glovar.watch_ids.get(the_type, {}).get(uid) != until:
+                continue
+
+            glovar.watch_ids[the_type].pop(uid, None)
+            result += 1
+    except Exception as e:
+        logger.warning(f"Purge watch ids error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return result
+
+
+def rebuild_trusted_ids() -> bool:
+    # Rebuild the index of trusted users from the trust lists
+    glovar.locks["trust"].acquire()
+    try:
+        trusted_ids = {}
+
+        for gid, uids in list(glovar.trust_ids.items()):
+            for uid in uids:
+                trusted_ids.setdefault(uid, set()).add(gid)
+
+        glovar.trusted_ids = trusted_ids
+
+        return True
+    except Exception as e:
+        logger.warning(f"Rebuild trusted ids error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return False
+
+
+def rebuild_user_ids() -> bool:
+    # Rebuild the total scores and the sorted join histories of the users
+    glovar.locks["message"].acquire()
+    try:
+        now = int(time())
+
+        for uid in list(glovar.user_ids):
+            user_status = glovar.user_ids[uid]
+            user_status["total"] = sum(user_status["score"].values())
+            user_status["join"] = dict(sorted(user_status["join"].items(), key=lambda x: x[1]))
+            prune_join_ids(uid, now)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Rebuild user ids error: {e}", exc_info=True)
+    finally:
+        glovar.locks["message"].release()
+
+    return False
+
+
+def rebuild_watch_heap() -> bool:
+    # Rebuild the expiry heap of the watch users
+    glovar.locks["watch"].acquire()
+    try:
+        heap = [(until, the_type, uid)
+                for the_type in list(glovar.watch_ids)
+                for uid, until in list(glovar.watch_ids[the_type].items())
+                if isinstance(until, int)]
+        heapify(heap)
+        glovar.watch_heap = heap
+
+        return True
+    except Exception as e:
+        logger.warning(f"Rebuild watch heap error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return False
+
+
+def remove_trust_ids(gid: int) -> bool:
+    # Remove a group's trust list and its users from the index
+    glovar.locks["trust"].acquire()
+    try:
+        for uid in glovar.trust_ids.pop(gid, set()):
+            gids = glovar.trusted_ids.get(uid, set())
+            gids.discard(gid)
+            not gids and glovar.trusted_ids.pop(uid, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Remove trust ids error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return False
+
+
+def set_trust_ids(gid: int, uids: Set[int]) -> bool:
+    # Set a group's trust list, keep the index of trusted users in sync
+    glovar.locks["trust"].acquire()
+    try:
+        old = glovar.trust_ids.get(gid, set())
+        glovar.trust_ids[gid] = uids
+
+        for uid in old - uids:
+            gids = glovar.trusted_ids.get(uid, set())
+            gids.discard(gid)
+            not gids and glovar.trusted_ids.pop(uid, None)
+
+        for uid in uids - old:
+            glovar.trusted_ids.setdefault(uid, set()).add(gid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set trust ids error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return False
+
+
+def update_user_score(uid: int, project: str, score: float) -> bool:
+    # Update a user's score from a project, keep the total score
+    try:
+        user_status = glovar.user_ids.get(uid)
+
+        if not user_status:
+            return False
+
+        user_status["score"][project] = score
+        user_status["total"] = sum(user_status["score"].values())
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update user score error: {e}", exc_info=True)
+
+    return False
@@ -0,0 +1,353 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread
+from time import time
+from typing import Any, Callable, Dict, Optional
+
+from telegram import InputFile, Update
+from telegram.error import BadRequest, Conflict, InvalidToken, NetworkError, TimedOut, Unauthorized
+from telegram.ext import Dispatcher
+from telegram.utils.request import Request
+
+from .. import glovar
+from .metrics import observe
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncRequest:
+    # Replace telegram.utils.request.Request, send the requests through one pooled aiohttp session
+    def __init__(self, runtime: "AsyncRuntime", connections: int, connect_timeout: float = 5.0,
+                 read_timeout: float = 5.0):
+        self.runtime = runtime
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._con_pool_size = connections
+        self.session = runtime.wait(self.get_session())
+
+    @property
+    def con_pool_size(self) -> int:
+        return self._con_pool_size
+
+    async def get_session(self):
+        connector = aiohttp.TCPConnector(limit=self._con_pool_size, keepalive_timeout=120)
+        return aiohttp.ClientSession(connector=connector)
+
+    def get_timeout(self, timeout: float = None):
+        return aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.connect_timeout,
+            sock_read=timeout if timeout is not None else self.read_timeout
+        )
+
+    @staticmethod
+    def parse(status: int, body: bytes) -> Any:
+        # Same as Request._request_wrapper and Request._parse
+        if 200 <= status <= 299:
+            return Request._parse(body)
+
+        try:
+            message = Request._parse(body)
+        except ValueError:
+            message = "Unknown HTTPError"
+
+        if status in {401, 403}:
+            raise Unauthorized(message)
+        elif status == 400:
+            raise BadRequest(message)
+        elif status == 404:
+            raise InvalidToken()
+        elif status == 409:
+            raise Conflict(message)
+        elif status == 502:
+            raise NetworkError("Bad Gateway")
+        else:
+            raise NetworkError(f"{message} ({status})")
+
+    async def request_async(self, method: str, url: str, timeout: float = None, **kwargs) -> (int, bytes):
+        try:
+            async with self.session.request(method, url, timeout=self.get_timeout(timeout), **kwargs) as resp:
+                return resp.status, await resp.read()
+        except asyncio.TimeoutError:
+            raise TimedOut()
+        except aiohttp.ClientError as e:
+            raise NetworkError(f"aiohttp ClientError {e}")
+
+    async def post_async(self, url: str, data: dict, timeout: float = None) -> Any:
+        start = time()
+        error = True
+
+        try:
+            result = await self.post_async_untimed(url, data, timeout)
+            error = False
+
+            return result
+        finally:
+            glovar.metrics and observe("telegram", url.rsplit("/", 1)[-1], time() - start, error)
+
+    async def post_async_untimed(self, url: str, data: dict, timeout: float = None) -> Any:
+        files = any(isinstance(val, InputFile) for val in data.values())
+
+        if files:
+            form = aiohttp.FormData()
+
+            for key, val in data.items():
+                if isinstance(val, InputFile):
+                    form.add_field(key, val.input_file_content, filename=val.filename, content_type=val.mimetype)
+                else:
+                    form.add_field(key, str(val))
+
+            status, body = await self.request_async("POST", url, timeout, data=form)
+        else:
+            status, body = await self.request_async("POST", url, timeout, json=data)
+
+        return self.parse(status, body)
+
+    def download(self, url: str, filename: str, timeout: float = None):
+        buf = self.retrieve(url, timeout)
+
+        with open(filename, "wb") as f:
+            f.write(buf)
+
+    def get(self, url: str, timeout: float = None) -> Any:
+        status, body = self.runtime.wait(self.request_async("GET", url, timeout))
+        return self.parse(status, body)
+
+    def post(self, url: str, data: dict, timeout: float = None) -> Any:
+        return self.runtime.wait(self.post_async(url, data, timeout))
+
+    def retrieve(self, url: str, timeout: float = None) -> bytes:
+        status, body = self.runtime.wait(self.request_async("GET", url, timeout))
+
+        if not 200 <= status <= 299:
+            self.parse(status, body)
+
+        return body
+
+    def stop(self):
+        self.runtime.wait(self.session.close())
+
+
+class AsyncRuntime:
+    # Run an event loop in a background thread, poll the updates and send the Bot API requests on it.
+    # check, check_join, process_data and the commands are not coroutines: they are shared with the
+    # threaded runtime and call the blocking Telegram wrappers, so each update holds an executor thread until it is done,
+    # so async_workers is the number of updates in flight. The fire-and-forget calls sent by submit
+    # do not hold a thread, they run on the loop with up to async_connections requests at once.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=glovar.async_workers)
+        self.dispatcher: Optional[Dispatcher] = None
+        self.polling: Optional[Future] = None
+        self.request: Optional[AsyncRequest] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+        self.request = dispatcher.bot.request
+        self.polling = asyncio.run_coroutine_threadsafe(self.poll(), self.loop)
+
+    def stop(self):
+        # Stop polling, let the updates in flight finish
+        if self.polling:
+            self.polling.cancel()
+            self.wait(self.finish())
+
+        self.executor.shutdown(wait=True)
+
+    def wait(self, coroutine) -> Any:
+        # Run a coroutine on the loop, block the calling thread until it is done
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def finish(self):
+        # Each update in flight holds the semaphore until it is handled
+        if not self.semaphore:
+            return
+
+        for _ in range(glovar.async_workers):
+            await self.semaphore.acquire()
+
+    async def handle(self, update: Update):
+        # Filters and callbacks are blocking code, run the whole update in the executor
+        try:
+            await self.loop.run_in_executor(self.executor, self.dispatcher.process_update, update)
+        except Exception as e:
+            logger.warning(f"Async handle error: {e}", exc_info=True)
+        finally:
+            self.semaphore.release()
+
+    async def poll(self):
+        # Long polling, do not take more updates than the executor threads can process
+        self.semaphore = asyncio.Semaphore(glovar.async_workers)
+        bot = self.dispatcher.bot
+        url = f"{bot.base_url}/getUpdates"
+        offset = 0
+
+        await self.request.post_async(f"{bot.base_url}/deleteWebhook", {})
+
+        while True:
+            try:
+                updates = await self.request.post_async(url, {"offset": offset, "timeout": 10}, 15)
+
+                for data in updates:
+                    offset = data["update_id"] + 1
+                    update = Update.de_json(data, bot)
+                    await self.semaphore.acquire()
+                    self.loop.create_task(self.handle(update))
+            except Exception as e:
+                logger.warning(f"Async poll error: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def call(self, method: str, data: dict) -> Any:
+        result = None
+        try:
+            url = f"{self.dispatcher.bot.base_url}/{method}"
+            result = await self.request.post_async(url, data)
+        except BadRequest as e:
+            logger.info(f"Async call {method} error: {e}")
+        except Exception as e:
+            logger.warning(f"Async call {method} error: {e}", exc_info=True)
+
+        return result
+
+
+def get_delete_message(_, cid: int, mid: int) -> Optional[dict]:
+    return cid and mid and {"chat_id": cid, "message_id": mid}
+
+
+def get_kick_chat_member(_, cid: int, uid: int) -> dict:
+    return {"chat_id": cid, "user_id": uid}
+
+
+def get_leave_chat(_, cid: int) -> dict:
+    return {"chat_id": cid}
+
+
+def get_restrict_chat_member(_, cid: int, uid: int, permissions, until_date: int = 0) -> dict:
+    return {"chat_id": cid, "user_id": uid, "permissions": permissions.to_dict(), "until_date": until_date}
+
+
+def get_send_message(_, cid: int, text: str, mid: int = None, markup=None) -> Optional[dict]:
+    if not text.strip():
+        return None
+
+    data = {
+        "chat_id": cid,
+        "text": text,
+        "parse_mode": "HTML",
+        "disable_web_page_preview": True
+    }
+
+    if mid:
+        data["reply_to_message_id"] = mid
+
+    if markup:
+        data["reply_markup"] = markup.to_json()
+
+    return data
+
+
+# Fire-and-forget Telegram functions that can be sent without a thread
+calls: Dict[str, tuple] = {
+    "delete_message": ("deleteMessage", get_delete_message),
+    "kick_chat_member": ("kickChatMember", get_kick_chat_member),
+    "leave_chat": ("leaveChat", get_leave_chat),
+    "restrict_chat_member": ("restrictChatMember", get_restrict_chat_member),
+    "send_message": ("sendMessage", get_send_message)
+}
+
+runtime: Optional[AsyncRuntime] = None
+
+
+def get_async_request() -> Optional[AsyncRequest]:
+    # Start the runtime, get the request object for the Bot
+    global runtime
+
+    result = None
+    try:
+        if aiohttp is None:
+            raise SystemExit("The async mode requires aiohttp")
+
+        runtime = runtime or AsyncRuntime()
+        result = AsyncRequest(runtime, glovar.async_connections, glovar.connect_timeout, glovar.read_timeout)
+    except Exception as e:
+        logger.critical(f"Get async request error: {e}", exc_info=True)
+
+    return result
+
+
+def start_async(dispatcher: Dispatcher) -> bool:
+    # Start to receive updates in the event loop
+    try:
+        runtime.start(dispatcher)
+
+        return True
+    except Exception as e:
+        logger.critical(f"Start async error: {e}", exc_info=True)
+
+    return False
+
+
+def stop_async() -> bool:
+    # Stop receiving updates in the event loop
+    try:
+        runtime and runtime.stop()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Stop async error: {e}", exc_info=True)
+
+    return False
+
+
+def submit(target: Callable, args: tuple) -> bool:
+    # Send a fire-and-forget Telegram function as a coroutine, return False if it is not supported
+    try:
+        if not runtime or not runtime.dispatcher:
+            return False
+
+        if not target.__module__.endswith("functions.telegram") or target.__name__ not in calls:
+            return False
+
+        method, get_data = calls[target.__name__]
+        data = get_data(*args)
+
+        if data:
+            asyncio.run_coroutine_threadsafe(runtime.call(method, data), runtime.loop)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Submit error: {e}", exc_info=True)
+
+    return False
@@ -0,0 +1,298 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from bisect import bisect_left
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from queue import Queue
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread, active_count
+from time import time
+from typing import Callable, Dict, List, Tuple
+
+from telegram.ext import Dispatcher
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Queues whose depths are reported
+queues: Dict[str, Queue] = {}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Serve the metrics in the Prometheus text format
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = get_prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    # Serve each scrape in its own thread
+    daemon_threads = True
+
+
+class TimedLock:
+    # Replace a lock, observe the time spent waiting for it
+    def __init__(self, name: str, lock: Lock):
+        self.name = name
+        self.lock = lock
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time()
+        result = self.lock.acquire(blocking, timeout)
+        observe("lock", self.name, time() - start)
+
+        return result
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def release(self):
+        self.lock.release()
+
+
+def add_queue(name: str, queue: Queue) -> bool:
+    # Report the depth of the queue
+    try:
+        queues[name] = queue
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add queue error: {e}", exc_info=True)
+
+    return False
+
+
+def get_depths() -> Dict[str, int]:
+    # Get the current queue depths
+    result = {}
+    try:
+        for name, queue in list(queues.items()):
+            result[name] = queue.qsize()
+
+        result["requests_in_flight"] = glovar.network_stats["in_flight"]
+        result["threads"] = active_count()
+    except Exception as e:
+        logger.warning(f"Get depths error: {e}", exc_info=True)
+
+    return result
+
+
+def get_prometheus_text() -> str:
+    # Get the metrics in the Prometheus text format
+    result = ""
+    try:
+        prefix = glovar.sender.lower()
+        lines = []
+
+        with glovar.locks["metrics"]:
+            metric_stats = deepcopy(glovar.metric_stats)
+
+        for kind in sorted(metric_stats):
+            name = f"{prefix}_{kind}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+
+            for label, stats in sorted(metric_stats[kind].items()):
+                total = 0
+
+                for le, count in zip(glovar.metric_buckets, stats["buckets"]):
+                    total += count
+                    lines.append(f'{name}_bucket{{name="{label}",le="{le}"}} {total}')
+
+                lines.append(f'{name}_bucket{{name="{label}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'{name}_sum{{name="{label}"}} {stats["sum"]}')
+                lines.append(f'{name}_count{{name="{label}"}} {stats["count"]}')
+
+            if kind == "lock":
+                continue
+
+            name = f"{prefix}_{kind}_errors_total"
+            lines.append(f"# TYPE {name} counter")
+
+            for label, stats in sorted(metric_stats[kind].items()):
+                lines.append(f'{name}{{name="{label}"}} {stats["errors"]}')
+
+        name = f"{prefix}_queue_depth"
+        lines.append(f"# TYPE {name} gauge")
+
+        for label, depth in sorted(get_depths().items()):
+            lines.append(f'{name}{{name="{label}"}} {depth}')
+
+        result = "\n".join(lines) + "\n"
+    except Exception as e:
+        logger.warning(f"Get prometheus text error: {e}", exc_info=True)
+
+    return result
+
+
+def get_quantile(buckets: List[int], count: int, q: float) -> float:
+    # Get the upper bound of the bucket that holds the quantile, -1.0 means beyond the last bucket
+    result = 0.0
+    try:
+        if not count:
+            return 0.0
+
+        total = 0
+
+        for le, number in zip(glovar.metric_buckets, buckets):
+            total += number
+
+            if total >= count * q:
+                return le
+
+        result = -1.0
+    except Exception as e:
+        logger.warning(f"Get quantile error: {e}", exc_info=True)
+
+    return result
+
+
+def get_summary() -> Dict[str, List[Tuple[str, int, int, float, float]]]:
+    # Get the count, errors, p50 and p99 of each observed name since the last summary
+    result = {}
+    try:
+        with glovar.locks["metrics"]:
+            metric_stats = deepcopy(glovar.metric_stats)
+            reported = glovar.metric_reported
+            glovar.metric_reported = metric_stats
+
+        for kind in sorted(metric_stats):
+            result[kind] = []
+
+            for name, stats in sorted(metric_stats[kind].items()):
+                old = reported.get(kind, {}).get(name)
+                buckets = stats["buckets"]
+                count = stats["count"]
+                errors = stats["errors"]
+
+                if old:
+                    buckets = [new - last for new, last in zip(buckets, old["buckets"])]
+                    count -= old["count"]
+                    errors -= old["errors"]
+
+                if not count:
+                    continue
+
+                p50 = get_quantile(buckets, count, 0.5)
+                p99 = get_quantile(buckets, count, 0.99)
+                result[kind].append((name, count, errors, p50, p99))
+    except Exception as e:
+        logger.warning(f"Get summary error: {e}", exc_info=True)
+
+    return result
+
+
+def init_metrics(dispatcher: Dispatcher) -> bool:
+    # Time the handlers and the locks, serve the metrics endpoint, must be called after the handlers are added
+    try:
+        if not glovar.metrics:
+            return True
+
+        add_queue("update_queue", dispatcher.update_queue)
+
+        for handlers in dispatcher.handlers.values():
+            for handler in handlers:
+                handler.callback = wrap_callback(handler.callback)
+
+        for name, lock in list(glovar.locks.items()):
+            if name == "metrics" or isinstance(lock, TimedLock):
+                continue
+
+            glovar.locks[name] = TimedLock(name, lock)
+
+        server = MetricsServer((glovar.metrics_listen, glovar.metrics_port), MetricsHandler)
+        t = Thread(target=server.serve_forever, daemon=True)
+        t.start()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init metrics error: {e}", exc_info=True)
+
+    return False
+
+
+def observe(kind: str, name: str, secs: float, error: bool = False) -> bool:
+    # Observe a timing in the histogram of the name
+    try:
+        with glovar.locks["metrics"]:
+            stats = glovar.metric_stats.setdefault(kind, {}).get(name)
+
+            if stats is None:
+                stats = glovar.metric_stats[kind][name] = {
+                    "buckets": [0] * len(glovar.metric_buckets),
+                    "count": 0,
+                    "errors": 0,
+                    "sum": 0.0
+                }
+
+            i = bisect_left(glovar.metric_buckets, secs)
+
+            if i < len(glovar.metric_buckets):
+                stats["buckets"][i] += 1
+
+            stats["count"] += 1
+            stats["sum"] += secs
+
+            if error:
+                stats["errors"] += 1
+
+        return True
+    except Exception as e:
+        logger.warning(f"Observe error: {e}", exc_info=True)
+
+    return False
+
+
+def wrap_callback(callback: Callable) -> Callable:
+    # Time the handler callback, a raised exception or a False result counts as an error
+    name = callback.__name__
+
+    def wrapped(update, context):
+        result = False
+        start = time()
+
+        try:
+            result = callback(update, context)
+        finally:
+            observe("handler", name, time() - start, result is False)
+
+        return result
+
+    wrapped.__name__ = name
+
+    return wrapped
@@ -0,0 +1,320 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from concurrent.futures import Future, TimeoutError
+from itertools import count
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recvfds, sendfds
+from os import _exit, close, fork, kill, pipe
+from queue import Queue
+from signal import SIG_DFL, SIG_IGN, SIGCHLD, SIGTERM, signal
+from socket import MSG_WAITALL, socket, socketpair
+from struct import pack, unpack
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    # A worker process with its own job and result pipes, a stuck worker is killed without harming the others
+    def __init__(self, index: int, pid: int, jobs: Connection, results: Connection):
+        self.index = index
+        self.pid = pid
+        self.jobs = jobs
+        self.results = results
+        self.outbox: Queue = Queue()
+        self.pending: Dict[int, Tuple[Callable, tuple]] = {}
+        self.lock = Lock()
+        Thread(target=self.run_sender, daemon=True).start()
+        Thread(target=self.run_receiver, daemon=True).start()
+
+    def put(self, job_id: Optional[int], target: Callable, args: tuple):
+        # The sender thread writes the job, so a full pipe of a stuck worker does not block the caller
+        if job_id is not None:
+            with self.lock:
+                self.pending[job_id] = (target, args)
+
+        self.outbox.put((job_id, target, args))
+
+    def run_receiver(self):
+        # Hand the results to the waiting jobs until the worker is gone
+        try:
+            while True:
+                job_id, result, hits = self.results.recv()
+
+                with self.lock:
+                    self.pending.pop(job_id, None)
+
+                with lock:
+                    future = futures.pop(job_id, None)
+
+                future and future.set_result((result, hits))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            logger.warning(f"Worker {self.index} receiver error: {e}", exc_info=True)
+        finally:
+            self.results.close()
+
+    def run_sender(self):
+        # Write the jobs to the worker until it is stopped
+        try:
+            while True:
+                job = self.outbox.get()
+
+                if job is None:
+                    break
+
+                self.jobs.send(job)
+        except OSError:
+            pass
+        except Exception as e:
+            logger.warning(f"Worker {self.index} sender error: {e}", exc_info=True)
+        finally:
+            self.jobs.close()
+
+    def stop(self):
+        # Kill the worker, its pipes are closed and its threads end
+        try:
+            kill(self.pid, SIGTERM)
+        except ProcessLookupError:
+            pass
+
+        self.outbox.put(None)
+
+
+# The worker processes
+workers: List[Worker] = []
+
+# The socket to the zygote process that forks the workers
+zygote: Optional[socket] = None
+
+# Jobs waiting for their results
+futures: Dict[int, Future] = {}
+
+# Job ids, also used to pick the worker in turn
+job_ids = count()
+
+# Protect the futures
+lock = Lock()
+
+# Protect the workers list and the shared calls, only one thread replaces a stuck worker
+restart = Lock()
+
+# The latest broadcast call of each target and first argument, a new worker gets them before any job
+shared: Dict[Tuple[str, Any], Tuple[Callable, tuple]] = {}
+
+
+def broadcast(target: Callable, args: tuple) -> bool:
+    # Run the target in every worker, before the jobs submitted after it
+    try:
+        with restart:
+            shared[(target.__name__, args and args[0])] = (target, args)
+
+            for worker in workers:
+                worker.put(None, target, args)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Broadcast error: {e}", exc_info=True)
+
+    return False
+
+
+def init_process() -> bool:
+    # Fork the zygote and the workers, must be called before any other thread is started
+    global zygote
+
+    try:
+        if not glovar.process_workers:
+            return True
+
+        zygote, child = socketpair()
+        p = get_context("fork").Process(target=run_zygote, args=(child,), daemon=True)
+        p.start()
+        child.close()
+
+        with restart:
+            for index in range(glovar.process_workers):
+                worker = start_worker(index)
+
+                if not worker:
+                    raise SystemExit("Cannot start the worker processes")
+
+                workers.append(worker)
+
+        return True
+    except Exception as e:
+        logger.critical(f"Init process error: {e}", exc_info=True)
+
+    return False
+
+
+def replace_worker(worker: Worker, job_id: int) -> Optional[Worker]:
+    # Replace a stuck worker, its oldest job is the stuck one, the jobs behind it move to the new worker.
+    # Return the worker the job still waits in, or None if the job is the stuck one
+    try:
+        with restart:
+            current = workers[worker.index]
+
+            if current is not worker:
+                with current.lock:
+                    return (job_id in current.pending and current) or None
+
+            with worker.lock:
+                pending = dict(worker.pending)
+
+            stuck = min(pending, default=None)
+            new = start_worker(worker.index)
+
+            if not new:
+                return None
+
+            moved = [the_id for the_id in sorted(pending) if the_id != stuck]
+
+            for the_id in moved:
+                new.put(the_id, *pending[the_id])
+
+            workers[worker.index] = new
+            worker.stop()
+            logger.warning(f"Worker {worker.index} is replaced, {len(moved)} jobs are moved")
+
+            return (job_id != stuck and new) or None
+    except Exception as e:
+        logger.warning(f"Replace worker error: {e}", exc_info=True)
+
+    return None
+
+
+def run_job(target: Callable, args: tuple, timeout_result: Any) -> Tuple[Any, List[Tuple[str, tuple]]]:
+    # Run the target in a worker, get the result and the rule hits, run it here if there is no worker.
+    # A stuck job is not run again, it gets the timeout result and its worker is replaced
+    try:
+        if not workers:
+            return target(*args), []
+
+        job_id = next(job_ids)
+        future = Future()
+
+        with lock:
+            futures[job_id] = future
+
+        with restart:
+            worker = workers[job_id % len(workers)]
+            worker.put(job_id, target, args)
+
+        while True:
+            try:
+                result, hits = future.result(timeout=glovar.process_timeout)
+
+                if result is None:
+                    break
+
+                return result, hits
+            except TimeoutError:
+                if future.done():
+                    continue
+
+                worker = replace_worker(worker, job_id)
+
+                if worker:
+                    continue
+
+                with lock:
+                    futures.pop(job_id, None)
+
+                logger.warning(f"Run job {target.__name__} timed out")
+
+                return timeout_result, []
+    except Exception as e:
+        logger.warning(f"Run job error: {e}", exc_info=True)
+
+    return target(*args), []
+
+
+def run_worker(jobs: Connection, results: Connection) -> None:
+    # Run the jobs in a worker process, the rule hits, timings and strikes are sent back to the main process
+    glovar.process_hits = []
+
+    while True:
+        try:
+            job_id, target, args = jobs.recv()
+        except (EOFError, OSError):
+            return
+
+        try:
+            result = target(*args)
+            job_id is not None and results.send((job_id, result, glovar.process_hits))
+        except Exception as e:
+            logger.warning(f"Run worker error: {e}", exc_info=True)
+            job_id is not None and results.send((job_id, None, []))
+        finally:
+            glovar.process_hits = []
+
+
+def run_zygote(sock: socket) -> None:
+    # Fork a worker for each pair of pipes received. The zygote is forked before any thread is started,
+    # so no lock of the logging, the queues or the regex module is copied into a worker as held
+    zygote.close()
+    signal(SIGCHLD, SIG_IGN)
+
+    while True:
+        try:
+            job_fd, result_fd = recvfds(sock, 2)
+        except (EOFError, OSError):
+            return
+
+        pid = fork()
+
+        if not pid:
+            signal(SIGCHLD, SIG_DFL)
+            sock.close()
+            run_worker(Connection(job_fd, writable=False), Connection(result_fd, readable=False))
+            _exit(0)
+
+        close(job_fd)
+        close(result_fd)
+        sock.sendall(pack("i", pid))
+
+
+def start_worker(index: int) -> Optional[Worker]:
+    # Ask the zygote for a new worker, send it the shared calls first. The restart lock is held by the caller
+    result = None
+    try:
+        job_read, job_write = pipe()
+        result_read, result_write = pipe()
+
+        sendfds(zygote, [job_read, result_write])
+        pid = unpack("i", zygote.recv(4, MSG_WAITALL))[0]
+        close(job_read)
+        close(result_write)
+
+        result = Worker(index, pid, Connection(job_write, readable=False), Connection(result_read, writable=False))
+
+        for target, args in shared.values():
+            result.put(None, target, args)
+    except Exception as e:
+        logger.critical(f"Start worker error: {e}", exc_info=True)
+
+    return result
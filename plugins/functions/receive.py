@@ -20,7 +20,7 @@ import logging
 import pickle
 from copy import deepcopy
 from json import loads
-from typing import Any
+from typing import Any, List, Union
 
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
@@ -28,29 +28,33 @@ from .. import glovar
 from .channel import get_debug_text, share_data
 from .etc import code, crypt_str, general_link, get_int, get_text, lang, mention_id, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .filters import check_regex, share_words
 from .group import get_config_text, leave_group
-from .ids import init_group_id, init_user_id
+from .ids import add_declared_message_id, add_watch_id, init_group_id, init_user_id, rebuild_trusted_ids
+from .ids import rebuild_user_ids, rebuild_watch_heap, remove_trust_ids, set_trust_ids, update_user_score
+from .shard import group_files, is_first
 from .telegram import send_message, send_report_message
-from .timers import update_admins
+from .timers import send_count, update_admins
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-def receive_add_bad(sender: str, data: dict) -> bool:
+def receive_add_bad(sender: str, data: Union[dict, List[dict]]) -> bool:
     # Receive bad users or channels that other bots shared
     try:
-        # Basic data
-        the_id = data["id"]
-        the_type = data["type"]
+        for item in (data if isinstance(data, list) else [data]):
+            # Basic data
+            the_id = item["id"]
+            the_type = item["type"]
 
-        # Receive bad channel
-        if sender == "MANAGE" and the_type == "channel":
-            glovar.bad_ids["channels"].add(the_id)
+            # Receive bad channel
+            if sender == "MANAGE" and the_type == "channel":
+                glovar.bad_ids["channels"].add(the_id)
 
-        # Receive bad user
-        if the_type == "user":
-            glovar.bad_ids["users"].add(the_id)
+            # Receive bad user
+            if the_type == "user":
+                glovar.bad_ids["users"].add(the_id)
 
         save("bad_ids")
 
@@ -131,7 +135,7 @@ def receive_clear_data(client: Bot, data_type: str, data: dict) -> bool:
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('clear'))}\n"
                 f"{lang('more')}{lang('colon')}{code(f'{data_type} {the_type}')}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        is_first() and thread(send_message, (client, glovar.debug_channel_id, text))
     except Exception as e:
         logger.warning(f"Receive clear data: {e}", exc_info=True)
     finally:
@@ -228,18 +232,34 @@ def receive_config_show(client: Bot, data: dict) -> bool:
     return False
 
 
-def receive_declared_message(data: dict) -> bool:
+def receive_count(client: Bot, data: str) -> bool:
+    # Receive regex count request
+    try:
+        if data != "ask":
+            return True
+
+        send_count(client)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Receive count error: {e}", exc_info=True)
+
+    return False
+
+
+def receive_declared_message(data: Union[dict, List[dict]]) -> bool:
     # Update declared message's id
     try:
-        # Basic data
-        gid = data["group_id"]
-        mid = data["message_id"]
+        for item in (data if isinstance(data, list) else [data]):
+            # Basic data
+            gid = item["group_id"]
+            mid = item["message_id"]
 
-        if not glovar.admin_ids.get(gid):
-            return True
+            if not glovar.admin_ids.get(gid):
+                continue
 
-        if init_group_id(gid):
-            glovar.declared_message_ids[gid].add(mid)
+            if init_group_id(gid):
+                add_declared_message_id(gid, mid)
 
         return True
     except Exception as e:
@@ -327,7 +347,7 @@ def receive_refresh(client: Bot, data: int) -> bool:
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('refresh'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        is_first() and thread(send_message, (client, glovar.debug_channel_id, text))
 
         return True
     except Exception as e:
@@ -356,10 +376,16 @@ def receive_regex(client: Bot, message: Message, data: str) -> bool:
 
         for word in pop_set:
             eval(f"glovar.{file_name}").pop(word, 0)
+            glovar.regex_stats.get(word_type, {}).pop(word, None)
+            glovar.regex_quarantine.get(word_type, set()).discard(word)
+            glovar.regex_timeouts.get(word_type, {}).pop(word, None)
 
         for word in new_set:
             eval(f"glovar.{file_name}")[word] = 0
 
+        # Check the new rules, a complex rule is guarded by the time budget
+        glovar.regex_guard and check_regex(word_type, new_set)
+
         save(file_name)
 
         # Regenerate special characters dictionary if possible
@@ -382,6 +408,12 @@ def receive_regex(client: Bot, message: Message, data: str) -> bool:
                 for k in keys:
                     eval(f"glovar.{special}_dict")[k] = value
 
+        # The cached name verdicts depend on the rules
+        glovar.names = {}
+
+        # Send the rules to the worker processes
+        share_words(word_type)
+
         return True
     except Exception as e:
         logger.warning(f"Receive regex error: {e}", exc_info=True)
@@ -491,15 +523,29 @@ def receive_rollback(client: Bot, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
+        # The backup of the group data comes from the first shard
+        if the_type in group_files and not is_first():
+            return True
+
         exec(f"glovar.{the_type} = the_data")
         save(the_type)
 
+        # Rebuild the indexes
+        the_type == "trust_ids" and rebuild_trusted_ids()
+        the_type == "user_ids" and rebuild_user_ids()
+        the_type == "watch_ids" and rebuild_watch_heap()
+
+        if the_type.endswith("_words"):
+            with glovar.locks["regex"]:
+                glovar.names = {}
+                share_words(the_type.split("_")[0])
+
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('rollback'))}\n"
                 f"{lang('more')}{lang('colon')}{code(the_type)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        is_first() and thread(send_message, (client, glovar.debug_channel_id, text))
     except Exception as e:
         logger.warning(f"Receive rollback error: {e}", exc_info=True)
 
@@ -522,19 +568,40 @@ def receive_text_data(message: Message) -> dict:
     return data
 
 
-def receive_user_score(project: str, data: dict) -> bool:
+def receive_trust_ids(data: List[list]) -> bool:
+    # Receive the trust lists of the groups of another shard
+    try:
+        for gid, uids in data:
+            if uids is None:
+                remove_trust_ids(gid)
+            else:
+                set_trust_ids(gid, set(uids))
+
+        save("trust_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Receive trust ids error: {e}", exc_info=True)
+
+    return False
+
+
+def receive_user_score(project: str, data: Union[dict, List[dict]]) -> bool:
     # Receive and update user's score
     glovar.locks["message"].acquire()
     try:
         # Basic data
         project = project.lower()
-        uid = data["id"]
 
-        if not init_user_id(uid):
-            return True
+        for item in (data if isinstance(data, list) else [data]):
+            uid = item["id"]
+
+            if not init_user_id(uid):
+                continue
+
+            score = item["score"]
+            update_user_score(uid, project, score)
 
-        score = data["score"]
-        glovar.user_ids[uid]["score"][project] = score
         save("user_ids")
 
         return True
@@ -546,25 +613,22 @@ def receive_user_score(project: str, data: dict) -> bool:
     return False
 
 
-def receive_watch_user(data: dict) -> bool:
+def receive_watch_user(data: Union[dict, List[dict]]) -> bool:
     # Receive watch users that other bots shared
     try:
-        # Basic data
-        the_type = data["type"]
-        uid = data["id"]
-        until = data["until"]
-
-        # Decrypt the data
-        until = crypt_str("decrypt", until, glovar.key)
-        until = get_int(until)
-
-        # Add to list
-        if the_type == "ban":
-            glovar.watch_ids["ban"][uid] = until
-        elif the_type == "delete":
-            glovar.watch_ids["delete"][uid] = until
-        else:
-            return False
+        for item in (data if isinstance(data, list) else [data]):
+            # Basic data
+            the_type = item["type"]
+            uid = item["id"]
+            until = item["until"]
+
+            # Decrypt the data
+            until = crypt_str("decrypt", until, glovar.key)
+            until = get_int(until)
+
+            # Add to list
+            if the_type in {"ban", "delete"}:
+                add_watch_id(the_type, uid, until)
 
         save("watch_ids")
 
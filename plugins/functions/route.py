@@ -0,0 +1,212 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from queue import Queue
+from threading import Thread
+from time import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from telegram import Bot, Message
+
+from .. import glovar
+from .metrics import add_queue
+from .shard import is_first, is_owner
+from .receive import receive_add_bad, receive_add_except, receive_clear_data, receive_config_commit
+from .receive import receive_config_reply, receive_config_show, receive_count, receive_declared_message
+from .receive import receive_leave_approve, receive_refresh, receive_regex, receive_remove_bad
+from .receive import receive_remove_except, receive_remove_score, receive_remove_watch, receive_rollback
+from .receive import receive_trust_ids, receive_user_score, receive_watch_user
+from .timers import backup_files
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Route: (sender, action, type) -> (target, argument names, slow, scope, barrier), the type "*" matches any type
+routes: Dict[Tuple[str, str, str], Tuple[Callable, Tuple[str, ...], bool, str, bool]] = {}
+
+# Slow routes are processed one by one in the background lane
+slow_lane: Queue = Queue()
+
+
+def add_route(senders: List[str], action: str, action_types: List[str], target: Callable, args: Tuple[str, ...],
+              slow: bool = False, scope: str = "", barrier: bool = False) -> bool:
+    # Register a route, args are the names passed to the target: client, message, sender, type, data.
+    # In the sharded mode, the scope "group" runs on the shard that owns data["group_id"], "first" on shard 0.
+    # A barrier route replaces the data, it runs in order after the slow routes queued before it are done
+    try:
+        for sender in senders:
+            for action_type in action_types:
+                routes[(sender, action, action_type)] = (target, args, slow, scope, barrier)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add route error: {e}", exc_info=True)
+
+    return False
+
+
+def count_route(key: Tuple[str, str, str], secs: float) -> bool:
+    # Count the route's calls and timings
+    try:
+        stats = glovar.route_stats.get(key)
+
+        if stats is None:
+            stats = glovar.route_stats[key] = {
+                "count": 0,
+                "time": 0.0,
+                "max": 0.0
+            }
+
+        stats["count"] += 1
+        stats["time"] += secs
+        stats["max"] = max(stats["max"], secs)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Count route error: {e}", exc_info=True)
+
+    return False
+
+
+def init_routes() -> bool:
+    # Init the routing table of the exchange channel, the permissions are intentionally explicit
+    try:
+        # Bots that share the common detection data
+        common = ["CLEAN", "LANG", "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK"]
+        add_route(common + ["USER", "MANAGE"], "add", ["bad"], receive_add_bad, ("sender", "data"))
+        add_route(common + ["WATCH"], "add", ["watch"], receive_watch_user, ("data",))
+        add_route(common, "update", ["declare"], receive_declared_message, ("data",))
+        add_route(common + ["CAPTCHA", "WARN"], "update", ["score"], receive_user_score, ("sender", "data"))
+
+        # CONFIG
+        add_route(["CONFIG"], "config", ["commit"], receive_config_commit, ("data",), scope="group")
+        add_route(["CONFIG"], "config", ["reply"], receive_config_reply, ("client", "data"), scope="group")
+
+        # LONG, the other shards of this bot
+        add_route(["LONG"], "add", ["bad"], receive_add_bad, ("sender", "data"))
+        add_route(["LONG"], "add", ["watch"], receive_watch_user, ("data",))
+        add_route(["LONG"], "update", ["score"], receive_user_score, ("sender", "data"))
+        add_route(["LONG"], "update", ["trust"], receive_trust_ids, ("data",))
+
+        # MANAGE
+        add_route(["MANAGE"], "add", ["except"], receive_add_except, ("data",))
+        add_route(["MANAGE"], "backup", ["now"], backup_files, ("client",), True, "first")
+        add_route(["MANAGE"], "backup", ["rollback"], receive_rollback, ("client", "message", "data"), barrier=True)
+        add_route(["MANAGE"], "clear", ["*"], receive_clear_data, ("client", "type", "data"))
+        add_route(["MANAGE"], "config", ["show"], receive_config_show, ("client", "data"), scope="group")
+        add_route(["MANAGE"], "leave", ["approve"], receive_leave_approve, ("client", "data"), scope="group")
+        add_route(["MANAGE"], "remove", ["bad"], receive_remove_bad, ("data",))
+        add_route(["MANAGE"], "remove", ["except"], receive_remove_except, ("data",))
+        add_route(["MANAGE"], "remove", ["score"], receive_remove_score, ("data",))
+        add_route(["MANAGE"], "remove", ["watch"], receive_remove_watch, ("data",))
+        add_route(["MANAGE"], "update", ["refresh"], receive_refresh, ("client", "data"), True)
+
+        # REGEX
+        add_route(["REGEX"], "regex", ["count"], receive_count, ("client", "data"), True, "first")
+        add_route(["REGEX"], "regex", ["update"], receive_regex, ("client", "message", "data"), True)
+
+        # Start the background lane
+        add_queue("slow_lane", slow_lane)
+        t = Thread(target=run_slow_lane, daemon=True)
+        t.start()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init routes error: {e}", exc_info=True)
+
+    return False
+
+
+def route_data(client: Bot, message: Message, sender: str, action: str, action_type: str, data: Any) -> bool:
+    # Route the exchange data to its handler, return False if there is no route
+    try:
+        key = (sender, action, action_type)
+        route = routes.get(key) or routes.get((sender, action, "*"))
+
+        if not route:
+            return False
+
+        target, names, slow, scope, barrier = route
+
+        # The other shards skip it
+        if scope == "group" and not is_owner(data["group_id"]):
+            return True
+
+        if scope == "first" and not is_first():
+            return True
+
+        values = {
+            "client": client,
+            "message": message,
+            "sender": sender,
+            "type": action_type,
+            "data": data
+        }
+        args = tuple(values[name] for name in names)
+
+        if slow:
+            slow_lane.put((key, target, args))
+        else:
+            # Do not let a slow route queued before it change the data after it
+            barrier and slow_lane.join()
+            run_route(key, target, args)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Route data error: {e}", exc_info=True)
+
+    return False
+
+
+def run_route(key: Tuple[str, str, str], target: Callable, args: tuple) -> bool:
+    # Run the route's handler, record the timing
+    result = False
+    start = time()
+
+    try:
+        result = target(*args)
+    except Exception as e:
+        logger.warning(f"Run route error: {e}", exc_info=True)
+    finally:
+        count_route(key, time() - start)
+
+    return result
+
+
+def run_slow_lane() -> None:
+    # Process the slow routes in order, so they do not block the state updates
+    while True:
+        try:
+            key, target, args = slow_lane.get()
+            run_route(key, target, args)
+            slow_lane.task_done()
+        except Exception as e:
+            logger.warning(f"Run slow lane error: {e}", exc_info=True)
+
+
+def wait_slow_lane() -> bool:
+    # Wait for the slow routes that are queued
+    try:
+        slow_lane.join()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Wait slow lane error: {e}", exc_info=True)
+
+    return False
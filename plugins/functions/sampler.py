@@ -0,0 +1,192 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import sys
+from os import getcwd
+from os.path import basename, relpath
+from signal import SIGUSR1, signal
+from threading import Lock, enumerate as enumerate_threads, get_ident
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Bot
+
+from .. import glovar
+from .etc import code, general_link, get_readable_time, lang, mention_id, thread
+from .file import delete_file
+from .telegram import send_document, send_message
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Held while the stacks are being sampled, only one run at a time
+sampling: Lock = Lock()
+
+
+def get_frame_name(frame, cwd: str) -> str:
+    # Get the name of a frame, such as "check (plugins/handlers/message.py:120)"
+    result = ""
+    try:
+        path = frame.f_code.co_filename
+
+        if path.startswith(cwd):
+            path = relpath(path, cwd)
+        elif "site-packages" in path:
+            path = path.split("site-packages", 1)[1].lstrip("/\\")
+        else:
+            path = basename(path)
+
+        result = f"{frame.f_code.co_name} ({path}:{frame.f_lineno})"
+    except Exception as e:
+        logger.warning(f"Get frame name error: {e}", exc_info=True)
+
+    return result
+
+
+def get_summary(stacks: Dict[str, int], top: int = 10) -> Tuple[int, int, List[Tuple[str, int]], List[Tuple[str, int]]]:
+    # Get the number of samples and threads, the busiest leaf frames and the busiest frames of the plugins
+    samples = 0
+    threads = set()
+    leaves = {}
+    plugins = {}
+
+    try:
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            samples += count
+            threads.add(frames[0])
+            leaves[frames[-1]] = leaves.get(frames[-1], 0) + count
+
+            # Count a function once per stack, the line numbers are merged
+            for name in {re.sub(r":\d+\)$", ")", f) for f in frames[1:] if "(plugins/" in f}:
+                plugins[name] = plugins.get(name, 0) + count
+    except Exception as e:
+        logger.warning(f"Get summary error: {e}", exc_info=True)
+
+    leaves = sorted(leaves.items(), key=lambda x: x[1], reverse=True)[:top]
+    plugins = sorted(plugins.items(), key=lambda x: x[1], reverse=True)[:top]
+
+    return samples, len(threads), leaves, plugins
+
+
+def init_sampler(client: Bot) -> bool:
+    # Sample the running bot on SIGUSR1, such as kill -USR1 <pid>
+    try:
+        signal(SIGUSR1, lambda *_: thread(send_profile, (client, glovar.sampler_time)))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init sampler error: {e}", exc_info=True)
+
+    return False
+
+
+def run_sampler(secs: float, interval: float) -> Optional[Dict[str, int]]:
+    # Sample the stacks of the other threads, return the collapsed stacks and their counts
+    if not sampling.acquire(blocking=False):
+        return None
+
+    stacks = {}
+
+    try:
+        cwd = getcwd()
+        ident = get_ident()
+        names = {}
+        end = time() + secs
+
+        while time() < end:
+            for tid, frame in sys._current_frames().items():
+                if tid == ident:
+                    continue
+
+                # The threads of the dispatcher and the helpers come and go
+                if tid not in names:
+                    names = {t.ident: t.name for t in enumerate_threads()}
+
+                frames = []
+
+                while frame is not None:
+                    frames.append(get_frame_name(frame, cwd))
+                    frame = frame.f_back
+
+                frames.append(names.get(tid, str(tid)).replace(";", ":"))
+                stack = ";".join(reversed(frames))
+                stacks[stack] = stacks.get(stack, 0) + 1
+
+            sleep(interval)
+    except Exception as e:
+        logger.warning(f"Run sampler error: {e}", exc_info=True)
+    finally:
+        sampling.release()
+
+    return stacks
+
+
+def send_profile(client: Bot, secs: int, aid: int = 0, cid: int = 0, mid: int = 0) -> bool:
+    # Sample the stacks for a while, send the collapsed stacks and the summary to the debug channel
+    try:
+        start = time()
+        stacks = run_sampler(secs, glovar.sampler_interval)
+
+        # Generate the text
+        text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                f"{lang('action')}{lang('colon')}{code(lang('sampler'))}\n")
+
+        if aid:
+            text += f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n"
+
+        if stacks is None:
+            text += (f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
+                     f"{lang('reason')}{lang('colon')}{code(lang('sampler_busy'))}\n")
+            thread(send_message, (client, cid or glovar.debug_channel_id, text, mid))
+
+            return False
+
+        samples, threads, leaves, plugins = get_summary(stacks)
+        text += (f"{lang('sampler_time')}{lang('colon')}{code(f'{time() - start:.1f}s')}\n"
+                 f"{lang('sampler_samples')}{lang('colon')}{code(samples)}\n"
+                 f"{lang('sampler_threads')}{lang('colon')}{code(threads)}\n")
+
+        for key, items in [("sampler_self", leaves), ("sampler_plugins", plugins)]:
+            if not items:
+                continue
+
+            text += f"{lang(key)}{lang('colon')}\n"
+
+            for name, count in items:
+                text += f"{code(name)} {count * 100 / samples:.1f}%\n"
+
+        # Write the collapsed stacks, one "thread;frame;frame count" per line, for flamegraph.pl or speedscope
+        file = f"tmp/profile-{glovar.sender.lower()}-{get_readable_time()}.txt"
+
+        with open(file, "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        send_message(client, glovar.debug_channel_id, text)
+        send_document(client, glovar.debug_channel_id, file, code(lang("sampler")))
+        cid and send_message(client, cid, text, mid)
+        delete_file(file)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send profile error: {e}", exc_info=True)
+
+    return False
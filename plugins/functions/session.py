@@ -0,0 +1,209 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from queue import Queue
+from signal import SIGABRT, SIGINT, SIGTERM, signal
+from threading import BoundedSemaphore, Event, Lock
+from time import time
+from typing import Optional
+
+from telegram import Bot, Update
+from telegram.ext import Dispatcher, JobQueue, Updater
+from telegram.utils.request import Request
+
+from .. import glovar
+from .loop import get_async_request, start_async, stop_async
+from .metrics import observe
+from .shard import start_shard
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class BoundedDispatcher(Dispatcher):
+    # Process updates with the worker threads, limit the number of updates in flight
+    def __init__(self, *args, flight_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flight = flight_size and BoundedSemaphore(flight_size)
+
+    def process_update(self, update: Update):
+        try:
+            if not self.workers or not self.flight or not isinstance(update, Update):
+                return super().process_update(update)
+
+            # Block the dispatcher thread while too many updates are in flight
+            self.flight.acquire()
+            self.run_async(self.process_update_async, update)
+        except Exception as e:
+            logger.warning(f"BoundedDispatcher process update error: {e}", exc_info=True)
+
+    def process_update_async(self, update: Update):
+        try:
+            super().process_update(update)
+        finally:
+            self.flight.release()
+
+
+class PooledRequest(Request):
+    # Reuse the pooled keep-alive connections. With a pool timeout, wait for a free one for a while,
+    # otherwise open an extra connection at once, the same as the default Request
+    def __init__(self, *args, pool_timeout: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = BoundedSemaphore(self.con_pool_size)
+        self.pool_timeout = pool_timeout
+        self.lock = Lock()
+
+    def _request_wrapper(self, *args, **kwargs):
+        start = time()
+
+        if self.pool_timeout:
+            acquired = self.pool.acquire(timeout=self.pool_timeout)
+        else:
+            acquired = self.pool.acquire(blocking=False)
+
+        self.count(time() - start, acquired)
+        error = True
+
+        try:
+            result = super()._request_wrapper(*args, **kwargs)
+            error = False
+
+            return result
+        finally:
+            acquired and self.pool.release()
+            glovar.metrics and observe("telegram", args[1].rsplit("/", 1)[-1], time() - start, error)
+
+            with self.lock:
+                glovar.network_stats["in_flight"] -= 1
+
+    def count(self, wait: float, acquired: bool):
+        # Count the pool saturation and the wait time
+        with self.lock:
+            stats = glovar.network_stats
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["in_flight_max"] = max(stats["in_flight_max"], stats["in_flight"])
+
+            if wait >= 0.001:
+                stats["waited"] += 1
+                stats["wait_time"] += wait
+                stats["wait_max"] = max(stats["wait_max"], wait)
+
+            if not acquired:
+                stats["overflow"] += 1
+
+
+def get_updater(token: str = None, request: Request = None) -> Optional[Updater]:
+    # Get the updater with a tuned dispatcher
+    result = None
+    try:
+        if request is None and glovar.async_enabled:
+            request = get_async_request()
+        elif request is None:
+            request = PooledRequest(
+                con_pool_size=glovar.pool_size,
+                connect_timeout=glovar.connect_timeout,
+                read_timeout=glovar.read_timeout,
+                pool_timeout=glovar.pool_timeout,
+                **(glovar.request_kwargs or {})
+            )
+
+        bot = Bot(
+            token=token or glovar.bot_token,
+            request=request
+        )
+        job_queue = JobQueue()
+        dispatcher = BoundedDispatcher(
+            bot=bot,
+            update_queue=Queue(maxsize=glovar.queue_size),
+            workers=glovar.workers,
+            exception_event=Event(),
+            job_queue=job_queue,
+            use_context=True,
+            flight_size=(not glovar.async_enabled and glovar.flight_size) or 0
+        )
+        job_queue.set_dispatcher(dispatcher)
+        result = Updater(
+            workers=None,
+            use_context=True,
+            dispatcher=dispatcher
+        )
+    except Exception as e:
+        logger.critical(f"Get updater error: {e}", exc_info=True)
+
+    return result
+
+
+def idle_updater() -> bool:
+    # Block until a stop signal, Updater.idle exits at once in the modes that do not start the updater itself
+    try:
+        stopping = Event()
+
+        for signum in (SIGINT, SIGTERM, SIGABRT):
+            signal(signum, lambda *_: stopping.set())
+
+        while not stopping.wait(1):
+            pass
+
+        return True
+    except Exception as e:
+        logger.warning(f"Idle updater error: {e}", exc_info=True)
+
+    return False
+
+
+def start_updater(updater: Updater) -> bool:
+    # Start to receive updates by webhook or long polling
+    try:
+        if glovar.async_enabled:
+            # Poll in the event loop, the updater only holds the dispatcher
+            start_async(updater.dispatcher)
+        elif glovar.shard_count:
+            # The router polls, this shard receives the updates of its groups
+            start_shard(updater.dispatcher)
+        elif glovar.webhook:
+            # TLS is terminated by the reverse proxy in front of the listener
+            updater.start_webhook(
+                listen=glovar.webhook_listen,
+                port=glovar.webhook_port,
+                url_path=glovar.webhook_path,
+                webhook_url=glovar.webhook_url
+            )
+        else:
+            updater.start_polling()
+
+        return True
+    except Exception as e:
+        logger.critical(f"Start updater error: {e}", exc_info=True)
+
+    return False
+
+
+def stop_updater(updater: Updater) -> bool:
+    # Stop receiving updates, let the updates in flight finish
+    try:
+        # The async handlers may still hand work to the dispatcher threads, stop them first
+        glovar.async_enabled and stop_async()
+        updater.stop()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Stop updater error: {e}", exc_info=True)
+
+    return False
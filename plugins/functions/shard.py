@@ -0,0 +1,399 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from json import dumps, loads
+from os import replace
+from os.path import exists
+from queue import Queue
+from socketserver import ThreadingMixIn
+from threading import Condition, Thread
+from time import sleep, time
+from typing import Any, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request as UrlRequest, urlopen
+
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+
+from .. import glovar
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    # Keep the data to post on disk until it is delivered, in order and at least once,
+    # so a restart of the router or a shard does not lose it. The file is appended to,
+    # the position file counts the delivered lines, and both are reset once all is delivered
+    def __init__(self, path: str):
+        self.path = path
+        self.condition = Condition()
+        self.items: List[list] = []
+        self.position = 0
+
+        if exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                # A line cut by a crash has no line break
+                self.items = [loads(line) for line in f if line.endswith("\n")]
+
+        if exists(f"{path}.position"):
+            with open(f"{path}.position", "r", encoding="utf-8") as f:
+                self.position = int(f.read() or 0)
+
+        self.items = self.items[self.position:]
+
+    def done(self):
+        # Remove the oldest item after it is delivered
+        with self.condition:
+            self.items.pop(0)
+            self.position += 1
+
+            if not self.items:
+                open(self.path, "w").close()
+                self.position = 0
+
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                f.write(str(self.position))
+
+            replace(f"{self.path}.tmp", f"{self.path}.position")
+
+    def get(self) -> Tuple[str, Any]:
+        # Wait for the oldest item
+        with self.condition:
+            while not self.items:
+                self.condition.wait()
+
+            url, data = self.items[0]
+
+            return url, data
+
+    def put(self, url: str, data: Any):
+        # Write the item to disk before it is acknowledged
+        with self.condition:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{dumps([url, data])}\n")
+
+            self.items.append([url, data])
+            self.condition.notify()
+
+
+class ShardServer(ThreadingMixIn, HTTPServer):
+    # Serve each request in its own thread
+    daemon_threads = True
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    # Relay the exchange data of a shard to the other shards
+    def do_POST(self):
+        try:
+            url = urlparse(self.path)
+
+            if url.path != "/sync":
+                self.send_error(404)
+                return
+
+            origin = int(parse_qs(url.query).get("from", ["-1"])[0])
+            data = loads(self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)))
+
+            for index, the_journal in enumerate(journals):
+                index != origin and the_journal.put(get_shard_url(index, "/sync"), data)
+
+            self.send_response(204)
+            self.end_headers()
+        except Exception as e:
+            logger.warning(f"RouterHandler error: {e}", exc_info=True)
+            self.send_error(400)
+
+    def log_message(self, *args):
+        pass
+
+
+class ShardHandler(BaseHTTPRequestHandler):
+    # Receive the updates routed to this shard and the exchange data of the other shards
+    def do_POST(self):
+        try:
+            path = urlparse(self.path).path
+
+            if path not in {"/update", "/sync"}:
+                self.send_error(404)
+                return
+
+            data = loads(self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)))
+
+            if path == "/sync":
+                data = get_sync_update(data)
+
+            inbox.put(Update.de_json(data, self.server.bot))
+
+            self.send_response(204)
+            self.end_headers()
+        except Exception as e:
+            logger.warning(f"ShardHandler error: {e}", exc_info=True)
+            self.send_error(400)
+
+    def log_message(self, *args):
+        pass
+
+
+# The outgoing updates of each shard, used by the router
+outboxes: List[Queue] = []
+
+# The channel posts and the exchange data of the other shards to each shard, used by the router
+journals: List[Journal] = []
+
+# The update queue of the dispatcher, used by the shard
+inbox: Optional[Queue] = None
+
+# The exchange data of this shard to the router, used by the shard
+journal: Optional[Journal] = None
+
+# The user data is not in a store shared by the shards. Each shard keeps its own copy, and the changes made by
+# this bot are relayed to the other shards through the router, see the LONG routes in route.py.
+# The other bots' data, including MANAGE's remove and clear, is posted in the channels, which reach every shard.
+# Both are kept in the journals until they are delivered, a restarted shard gets what it missed
+synced: Set[Tuple[str, str]] = {("add", "bad"), ("add", "watch"), ("update", "score")}
+
+# The data files that hold the data of the groups, each shard only has its own groups.
+# trust_ids is not one of them, the admins of any group are trusted in every group, see sync_trust
+group_files: Set[str] = {"admin_ids", "configs"}
+
+
+def get_shard(cid: int) -> int:
+    # Get the shard that owns the chat
+    result = 0
+    try:
+        result = cid % glovar.shard_count
+    except Exception as e:
+        logger.warning(f"Get shard error: {e}", exc_info=True)
+
+    return result
+
+
+def get_shard_url(index: int, path: str) -> str:
+    # Get the url of a shard, the router uses the base port, shard i uses the port after base + i
+    return f"http://{glovar.shard_listen}:{glovar.shard_port + 1 + index}{path}"
+
+
+def get_shards(data: dict) -> List[int]:
+    # Get the shards of the update, posts of the channels go to every shard
+    result = [0]
+    try:
+        for key in ["message", "edited_message", "channel_post", "edited_channel_post", "callback_query"]:
+            message = data.get(key)
+
+            if not message:
+                continue
+
+            message = message.get("message", message) if key == "callback_query" else message
+            chat = message.get("chat") or {}
+
+            if chat.get("type") == "channel":
+                return list(range(glovar.shard_count))
+
+            if chat.get("id"):
+                return [get_shard(chat["id"])]
+
+        for key in ["my_chat_member", "chat_member"]:
+            chat = (data.get(key) or {}).get("chat") or {}
+
+            if chat.get("id"):
+                return [get_shard(chat["id"])]
+    except Exception as e:
+        logger.warning(f"Get shards error: {e}", exc_info=True)
+
+    return result
+
+
+def get_sync_update(data: dict) -> dict:
+    # Get a channel post update that carries the exchange data of another shard
+    if glovar.should_hide:
+        cid = glovar.hide_channel_id
+    else:
+        cid = glovar.exchange_channel_id
+
+    return {
+        "update_id": 0,
+        "channel_post": {
+            "message_id": 0,
+            "date": int(time()),
+            "chat": {"id": cid, "type": "channel"},
+            "text": dumps(data)
+        }
+    }
+
+
+def is_first() -> bool:
+    # Check if this is the first shard, it runs the jobs and sends the reports that are once per bot
+    return not glovar.shard_index
+
+
+def is_owner(gid: int) -> bool:
+    # Check if this shard owns the group
+    return not glovar.shard_count or get_shard(gid) == glovar.shard_index
+
+
+def post_json(url: str, data: dict) -> bool:
+    # Post the data as JSON
+    try:
+        request = UrlRequest(url, dumps(data).encode("utf-8"), {"Content-Type": "application/json"})
+
+        with urlopen(request, timeout=glovar.read_timeout) as response:
+            response.read()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Post json error: {e}")
+
+    return False
+
+
+def run_journal(the_journal: Journal) -> None:
+    # Post the kept data in order, retry while the receiver is down
+    while True:
+        try:
+            url, data = the_journal.get()
+
+            while not post_json(url, data):
+                sleep(1)
+
+            the_journal.done()
+        except Exception as e:
+            logger.warning(f"Run journal error: {e}", exc_info=True)
+            sleep(1)
+
+
+def run_outbox(index: int) -> None:
+    # Send the updates of a shard in order, retry while the shard is down
+    outbox = outboxes[index]
+    url = get_shard_url(index, "/update")
+
+    while True:
+        try:
+            data = outbox.get()
+
+            while not post_json(url, data):
+                sleep(1)
+        except Exception as e:
+            logger.warning(f"Run outbox error: {e}", exc_info=True)
+
+
+def run_router(bot: Bot) -> bool:
+    # Receive the updates by long polling, route them to the shards by the chat id
+    try:
+        for index in range(glovar.shard_count):
+            outboxes.append(Queue())
+            t = Thread(target=run_outbox, args=(index,), daemon=True)
+            t.start()
+
+            # The data kept while a shard or the router was down is sent first
+            journals.append(Journal(f"data/journal_{index}"))
+            t = Thread(target=run_journal, args=(journals[index],), daemon=True)
+            t.start()
+
+        server = ShardServer((glovar.shard_listen, glovar.shard_port), RouterHandler)
+        t = Thread(target=server.serve_forever, daemon=True)
+        t.start()
+
+        bot.delete_webhook()
+        offset = 0
+
+        while True:
+            try:
+                updates = bot.get_updates(offset=offset, timeout=10)
+            except Exception as e:
+                logger.warning(f"Get updates error: {e}")
+                sleep(1)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                data = update.to_dict()
+
+                for index in get_shards(data):
+                    # The channel posts carry the data of the other bots, keep them until the shard gets them
+                    if data.get("channel_post") or data.get("edited_channel_post"):
+                        journals[index].put(get_shard_url(index, "/update"), data)
+                    else:
+                        outboxes[index].put(data)
+    except Exception as e:
+        logger.critical(f"Run router error: {e}", exc_info=True)
+
+    return False
+
+
+def start_shard(dispatcher: Dispatcher) -> bool:
+    # Start the dispatcher, receive the updates from the router
+    global inbox, journal
+
+    try:
+        inbox = dispatcher.update_queue
+        t = Thread(target=dispatcher.start, daemon=True)
+        t.start()
+
+        # The data kept while the router was down is sent first
+        journal = Journal("data/journal")
+        t = Thread(target=run_journal, args=(journal,), daemon=True)
+        t.start()
+
+        server = ShardServer((glovar.shard_listen, glovar.shard_port + 1 + glovar.shard_index), ShardHandler)
+        server.bot = dispatcher.bot
+        t = Thread(target=server.serve_forever, daemon=True)
+        t.start()
+
+        return True
+    except Exception as e:
+        logger.critical(f"Start shard error: {e}", exc_info=True)
+
+    return False
+
+
+def sync_shards(action: str, action_type: str, data: Any) -> bool:
+    # Send the exchange data to the other shards through the router, it is kept until the router gets it
+    try:
+        data = {
+            "from": glovar.sender,
+            "to": [glovar.sender],
+            "action": action,
+            "type": action_type,
+            "data": data
+        }
+        url = f"http://{glovar.shard_listen}:{glovar.shard_port}/sync?from={glovar.shard_index}"
+        journal.put(url, data)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Sync shards error: {e}", exc_info=True)
+
+    return False
+
+
+def sync_trust(gids: List[int]) -> bool:
+    # Send the trust lists of the own groups to the other shards, None removes the group's list
+    try:
+        if not glovar.shard_count or not gids:
+            return True
+
+        data = [[gid, sorted(glovar.trust_ids[gid]) if gid in glovar.trust_ids else None] for gid in gids]
+
+        return sync_shards("update", "trust", data)
+    except Exception as e:
+        logger.warning(f"Sync trust error: {e}", exc_info=True)
+
+    return False
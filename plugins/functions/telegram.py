@@ -17,6 +17,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from threading import Event
+from time import time
 from typing import List, Optional, Union
 
 from telegram import Bot, Chat, ChatMember, ChatPermissions, InlineKeyboardMarkup, Message, ParseMode
@@ -65,12 +67,12 @@ def download_media(client: Bot, file_id: str, file_path: str) -> Optional[str]:
     return result
 
 
-def get_admins(client: Bot, cid: int) -> Union[bool, List[ChatMember], None]:
+def get_admins(client: Bot, cid: int, timeout: float = None) -> Union[bool, List[ChatMember], None]:
     # Get a group's admins
     result = None
     try:
         try:
-            result = client.get_chat_administrators(chat_id=cid)
+            result = client.get_chat_administrators(chat_id=cid, timeout=timeout)
         except BadRequest:
             return False
     except Exception as e:
@@ -79,12 +81,12 @@ def get_admins(client: Bot, cid: int) -> Union[bool, List[ChatMember], None]:
     return result
 
 
-def get_chat(client: Bot, cid: Union[int, str]) -> Optional[Chat]:
+def get_chat(client: Bot, cid: Union[int, str], timeout: float = None) -> Optional[Chat]:
     # Get a chat
     result = None
     try:
         try:
-            result = client.get_chat(chat_id=cid)
+            result = client.get_chat(chat_id=cid, timeout=timeout)
         except BadRequest:
             return None
     except Exception as e:
@@ -93,12 +95,12 @@ def get_chat(client: Bot, cid: Union[int, str]) -> Optional[Chat]:
     return result
 
 
-def get_chat_member(client: Bot, cid: int, uid: int) -> Union[bool, ChatMember, None]:
+def get_chat_member(client: Bot, cid: int, uid: int, timeout: float = None) -> Union[bool, ChatMember, None]:
     # Get a chat member
     result = None
     try:
         try:
-            result = client.get_chat_member(chat_id=cid, user_id=uid)
+            result = client.get_chat_member(chat_id=cid, user_id=uid, timeout=timeout)
         except BadRequest:
             return False
     except Exception as e:
@@ -107,21 +109,57 @@ def get_chat_member(client: Bot, cid: int, uid: int) -> Union[bool, ChatMember,
     return result
 
 
+def get_chat_cache(client: Bot, cid: int, cache: bool = True) -> Optional[Chat]:
+    # Get a chat from the cache, concurrent callers share one request
+    result = None
+    try:
+        if not cache:
+            return get_chat(client, cid)
+
+        now = time()
+
+        with glovar.locks["chat"]:
+            the_cache = glovar.chats.get(cid)
+
+            if the_cache and now - the_cache["time"] < glovar.time_chat:
+                return the_cache["chat"]
+
+            event = glovar.chats_pending.get(cid)
+            owner = event is None
+
+            if owner:
+                event = Event()
+                glovar.chats_pending[cid] = event
+
+        # Wait for the request in flight
+        if not owner:
+            event.wait(30)
+            the_cache = glovar.chats.get(cid)
+            return the_cache and the_cache["chat"]
+
+        try:
+            result = get_chat(client, cid)
+            result and set_chat_cache(result)
+        finally:
+            with glovar.locks["chat"]:
+                glovar.chats_pending.pop(cid, None)
+
+            event.set()
+    except Exception as e:
+        logger.warning(f"Get chat cache {cid} error: {e}", exc_info=True)
+
+    return result
+
+
 def get_group_info(client: Bot, chat: Union[int, Chat], cache: bool = True) -> (str, str):
     # Get a group's name and link
     group_name = "Unknown Group"
     group_link = glovar.default_group_link
     try:
         if isinstance(chat, int):
-            the_cache = glovar.chats.get(chat)
-
-            if the_cache:
-                result = get_chat(client, chat)
-
-                if cache and result:
-                    glovar.chats[chat] = result
-
-                chat = result
+            chat = get_chat_cache(client, chat, cache)
+        elif chat and cache:
+            update_chat_cache(chat)
 
         if not chat:
             return group_name, group_link
@@ -253,3 +291,46 @@ def send_report_message(secs: int, client: Bot, cid: int, text: str, mid: int =
         logger.warning(f"Send report message to {cid} error: {e}", exc_info=True)
 
     return result
+
+
+def set_chat_cache(chat: Chat) -> bool:
+    # Put a chat into the cache, drop the oldest entries when it is full
+    try:
+        with glovar.locks["chat"]:
+            glovar.chats.pop(chat.id, None)
+            glovar.chats[chat.id] = {
+                "chat": chat,
+                "time": time()
+            }
+
+            while len(glovar.chats) > glovar.limit_chat:
+                glovar.chats.pop(next(iter(glovar.chats)), None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set chat cache error: {e}", exc_info=True)
+
+    return False
+
+
+def update_chat_cache(chat: Chat) -> bool:
+    # Invalidate the cached chat if its title or username has changed
+    try:
+        the_cache = glovar.chats.get(chat.id)
+
+        if not the_cache:
+            return True
+
+        cached = the_cache["chat"]
+
+        if cached.title == chat.title and cached.username == chat.username:
+            return True
+
+        with glovar.locks["chat"]:
+            glovar.chats.pop(chat.id, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update chat cache error: {e}", exc_info=True)
+
+    return False
@@ -17,15 +17,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from math import ceil
+from time import sleep, time
+from typing import Optional
 
 from telegram import Bot
 
 from .. import glovar
-from .channel import share_data, share_regex_count
+from .channel import share_data, share_regex_count, share_regex_profile
 from .etc import code, general_link, lang, thread
 from .file import save
 from .group import leave_group
+from .ids import prune_declared_message_ids, prune_recorded_ids, purge_watch_ids, set_trust_ids
+from .metrics import get_depths, get_summary
+from .shard import is_first, is_owner, sync_trust
 from .telegram import get_admins, get_chat_member, get_group_info, send_message
 
 # Enable logging
@@ -58,19 +64,73 @@ def backup_files(client: Bot) -> bool:
     return False
 
 
+def get_admins_status(client: Bot, gid: int) -> Optional[dict]:
+    # Get a group's admin status, only call the API, do not change any data
+    result = None
+    try:
+        admin_members = get_admins(client, gid, glovar.admin_timeout)
+
+        if admin_members is None:
+            return None
+
+        result = {
+            "admins": admin_members,
+            "nospam": False
+        }
+
+        if admin_members and any(admin.user.id == glovar.long_id for admin in admin_members):
+            chat_member = get_chat_member(client, gid, glovar.nospam_id, glovar.admin_timeout)
+            result["nospam"] = bool(chat_member)
+    except Exception as e:
+        logger.warning(f"Get admins status in {gid} error: {e}", exc_info=True)
+
+    return result
+
+
 def interval_min_10() -> bool:
     # Execute every 10 minutes
-    glovar.locks["message"].acquire()
     try:
-        # Clear recorded users
+        # Clear expired recorded users
         for gid in list(glovar.recorded_ids):
-            glovar.recorded_ids[gid] = set()
+            prune_recorded_ids(gid)
+
+        # Clear expired declared messages
+        for gid in list(glovar.declared_message_ids):
+            prune_declared_message_ids(gid)
+
+        # Purge expired watch users
+        purge_watch_ids() and save("watch_ids")
+
+        # Log the request pool saturation
+        stats = glovar.network_stats
+
+        if stats["waited"] or stats["overflow"]:
+            logger.warning(f"Request pool {glovar.pool_size}: "
+                           f"{stats['requests']} requests, {stats['in_flight_max']} max in flight, "
+                           f"{stats['waited']} waited {stats['wait_time']:.2f}s (max {stats['wait_max']:.2f}s), "
+                           f"{stats['overflow']} overflowed")
+
+        for key in ["requests", "in_flight_max", "waited", "overflow", "wait_time", "wait_max"]:
+            stats[key] = 0
+
+        # Log where the long text checks stopped
+        if glovar.long_stats:
+            logger.info(f"Long text stages: {glovar.long_stats}")
+            glovar.long_stats = {}
+
+        # Log the slow exchange routes
+        for key, stats in list(glovar.route_stats.items()):
+            if stats["max"] < 1:
+                continue
+
+            logger.warning(f"Route {' '.join(key)}: {stats['count']} calls, "
+                           f"{stats['time']:.2f}s in total, {stats['max']:.2f}s max")
+
+        glovar.route_stats = {}
 
         return True
     except Exception as e:
         logger.warning(f"Interval min 10 error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -93,7 +153,7 @@ def reset_data(client: Bot) -> bool:
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('reset'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        is_first() and thread(send_message, (client, glovar.debug_channel_id, text))
 
         return True
     except Exception as e:
@@ -108,6 +168,7 @@ def send_count(client: Bot) -> bool:
     try:
         for word_type in glovar.regex:
             share_regex_count(client, word_type)
+            glovar.regex_profile and share_regex_profile(client, word_type)
             word_list = list(eval(f"glovar.{word_type}_words"))
 
             for word in word_list:
@@ -115,6 +176,8 @@ def send_count(client: Bot) -> bool:
 
             save(f"{word_type}_words")
 
+        glovar.regex_stats = {}
+
         return True
     except Exception as e:
         logger.warning(f"Send count error: {e}", exc_info=True)
@@ -124,89 +187,112 @@ def send_count(client: Bot) -> bool:
     return False
 
 
+def send_metrics(client: Bot) -> bool:
+    # Send the metrics summary since the last one to the debug channel
+    try:
+        summary = get_summary()
+        depths = get_depths()
+        text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                f"{lang('action')}{lang('colon')}{code(lang('metrics'))}\n")
+
+        for kind in ["handler", "telegram", "lock"]:
+            # Show the busiest ones, a post is limited to 4096 characters
+            items = sorted(summary.get(kind, []), key=lambda x: x[1], reverse=True)[:10]
+
+            if not items:
+                continue
+
+            text += f"{lang(f'metrics_{kind}')}{lang('colon')}\n"
+
+            for name, count, errors, p50, p99 in items:
+                p50 = (p50 < 0 and f">{glovar.metric_buckets[-1]}") or p50
+                p99 = (p99 < 0 and f">{glovar.metric_buckets[-1]}") or p99
+                text += f"{code(name)} {count} / {errors} / p50 {p50}s / p99 {p99}s\n"
+
+        text += f"{lang('metrics_queue')}{lang('colon')}\n"
+
+        for name, depth in sorted(depths.items()):
+            text += f"{code(name)} {depth}\n"
+
+        thread(send_message, (client, glovar.debug_channel_id, text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send metrics error: {e}", exc_info=True)
+
+    return False
+
+
+def send_regex_reports(client: Bot) -> bool:
+    # Send the quarantined and the complex rules to the debug channel
+    try:
+        with glovar.locks["regex"]:
+            reports = glovar.regex_reports
+            glovar.regex_reports = []
+
+        for word_type, word, reason in reports:
+            status = (reason == "complex" and lang("regex_watch")) or lang("regex_quarantine")
+            text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                    f"{lang('action')}{lang('colon')}{code(lang('regex_guard'))}\n"
+                    f"{lang('regex_type')}{lang('colon')}{code(word_type)}\n"
+                    f"{lang('rule')}{lang('colon')}{code(word)}\n"
+                    f"{lang('status')}{lang('colon')}{code(status)}\n"
+                    f"{lang('reason')}{lang('colon')}{code(lang(f'regex_{reason}'))}\n")
+            thread(send_message, (client, glovar.debug_channel_id, text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send regex reports error: {e}", exc_info=True)
+
+    return False
+
+
 def update_admins(client: Bot) -> bool:
     # Update admin list every day
     glovar.locks["admin"].acquire()
     try:
-        group_list = list(glovar.admin_ids)
-
-        for gid in group_list:
-            should_leave = True
-            reason = "permissions"
-            admin_members = get_admins(client, gid)
-
-            if admin_members and any([admin.user.id == glovar.long_id for admin in admin_members]):
-                # Admin list
-                glovar.admin_ids[gid] = {admin.user.id for admin in admin_members
-                                         if ((admin.can_delete_messages
-                                              and admin.can_restrict_members)
-                                             or admin.status == "creator")}
-                save("admin_ids")
-
-                # Trust list
-                glovar.trust_ids[gid] = {admin.user.id for admin in admin_members}
-                save("trust_ids")
-
-                # Get bot admins
-                chat_member = get_chat_member(client, gid, glovar.nospam_id)
-                chat_member and glovar.admin_ids[gid].add(glovar.nospam_id)
-                save("admin_ids")
-
-                if glovar.user_id not in glovar.admin_ids[gid]:
-                    reason = "user"
+        start = time()
+        # In the sharded mode, each shard refreshes its own groups
+        group_list = [gid for gid in list(glovar.admin_ids) if is_owner(gid)]
+        total = len(group_list)
+        finished = 0
+        failed = 0
+
+        # Fetch admin lists concurrently
+        executor = ThreadPoolExecutor(max_workers=glovar.admin_workers)
+        futures = {executor.submit(get_admins_status, client, gid): gid for gid in group_list}
+        # Each group makes up to two calls, get_admins and get_chat_member, each bounded by admin_timeout
+        deadline = glovar.admin_timeout * 2 * (ceil(total / glovar.admin_workers) + 1)
+
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                gid = futures[future]
+                status = future.result()
+                finished += 1
+
+                if status is None:
+                    failed += 1
                 else:
-                    for admin in admin_members:
-                        if (admin.user.id == glovar.long_id
-                                and admin.can_delete_messages
-                                and admin.can_restrict_members):
-                            should_leave = False
-
-                if not should_leave:
-                    continue
-
-                group_name, group_link = get_group_info(client, gid)
-                share_data(
-                    client=client,
-                    receivers=["MANAGE"],
-                    action="leave",
-                    action_type="request",
-                    data={
-                        "group_id": gid,
-                        "group_name": group_name,
-                        "group_link": group_link,
-                        "reason": reason
-                    }
-                )
-                reason = lang(f"reason_{reason}")
-                project_link = general_link(glovar.project_name, glovar.project_link)
-                debug_text = (f"{lang('project')}{lang('colon')}{project_link}\n"
-                              f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
-                              f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
-                              f"{lang('status')}{lang('colon')}{code(reason)}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
-            elif (admin_members is False
-                  or any([admin.user.id == glovar.long_id for admin in admin_members]) is False):
-                # Bot is not in the chat, leave automatically without approve
-                group_name, group_link = get_group_info(client, gid)
-                leave_group(client, gid)
-                share_data(
-                    client=client,
-                    receivers=["MANAGE"],
-                    action="leave",
-                    action_type="info",
-                    data={
-                        "group_id": gid,
-                        "group_name": group_name,
-                        "group_link": group_link
-                    }
-                )
-                project_text = general_link(glovar.project_name, glovar.project_link)
-                debug_text = (f"{lang('project')}{lang('colon')}{project_text}\n"
-                              f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
-                              f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
-                              f"{lang('status')}{lang('colon')}{code(lang('leave_auto'))}\n"
-                              f"{lang('reason')}{lang('colon')}{code(lang('reason_leave'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                    update_admins_group(client, gid, status)
+
+                if total >= 10 and finished % (total // 10) == 0:
+                    logger.info(f"Update admins progress: {finished}/{total}")
+        except TimeoutError:
+            failed += total - finished
+            logger.warning(f"Update admins timeout: {total - finished} groups are not finished")
+
+            # Drop the calls not started yet
+            for future in futures:
+                future.cancel()
+        finally:
+            # The running groups are bounded by their calls, wait for them while holding the lock
+            executor.shutdown(wait=True)
+
+        save("admin_ids")
+        save("trust_ids")
+        sync_trust(group_list)
+
+        logger.warning(f"Update admins: {finished}/{total} groups in {time() - start:.1f}s, {failed} failed")
 
         return True
     except Exception as e:
@@ -217,6 +303,89 @@ def update_admins(client: Bot) -> bool:
     return False
 
 
+def update_admins_group(client: Bot, gid: int, status: dict) -> bool:
+    # Update a group's admin list by the fetched status
+    try:
+        should_leave = True
+        reason = "permissions"
+        admin_members = status["admins"]
+
+        if admin_members and any([admin.user.id == glovar.long_id for admin in admin_members]):
+            # Admin list
+            glovar.admin_ids[gid] = {admin.user.id for admin in admin_members
+                                     if ((admin.can_delete_messages
+                                          and admin.can_restrict_members)
+                                         or admin.status == "creator")}
+
+            # Trust list
+            set_trust_ids(gid, {admin.user.id for admin in admin_members})
+
+            # Get bot admins
+            status["nospam"] and glovar.admin_ids[gid].add(glovar.nospam_id)
+
+            if glovar.user_id not in glovar.admin_ids[gid]:
+                reason = "user"
+            else:
+                for admin in admin_members:
+                    if (admin.user.id == glovar.long_id
+                            and admin.can_delete_messages
+                            and admin.can_restrict_members):
+                        should_leave = False
+
+            if not should_leave:
+                return True
+
+            group_name, group_link = get_group_info(client, gid)
+            share_data(
+                client=client,
+                receivers=["MANAGE"],
+                action="leave",
+                action_type="request",
+                data={
+                    "group_id": gid,
+                    "group_name": group_name,
+                    "group_link": group_link,
+                    "reason": reason
+                }
+            )
+            reason = lang(f"reason_{reason}")
+            project_link = general_link(glovar.project_name, glovar.project_link)
+            debug_text = (f"{lang('project')}{lang('colon')}{project_link}\n"
+                          f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
+                          f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
+                          f"{lang('status')}{lang('colon')}{code(reason)}\n")
+            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+        elif (admin_members is False
+              or any([admin.user.id == glovar.long_id for admin in admin_members]) is False):
+            # Bot is not in the chat, leave automatically without approve
+            group_name, group_link = get_group_info(client, gid)
+            leave_group(client, gid)
+            share_data(
+                client=client,
+                receivers=["MANAGE"],
+                action="leave",
+                action_type="info",
+                data={
+                    "group_id": gid,
+                    "group_name": group_name,
+                    "group_link": group_link
+                }
+            )
+            project_text = general_link(glovar.project_name, glovar.project_link)
+            debug_text = (f"{lang('project')}{lang('colon')}{project_text}\n"
+                          f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
+                          f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
+                          f"{lang('status')}{lang('colon')}{code(lang('leave_auto'))}\n"
+                          f"{lang('reason')}{lang('colon')}{code(lang('reason_leave'))}\n")
+            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update admins group {gid} error: {e}", exc_info=True)
+
+    return False
+
+
 def update_status(client: Bot, the_type: str) -> bool:
     # Update running status to BACKUP
     try:
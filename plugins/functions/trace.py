@@ -0,0 +1,160 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from random import random
+from time import perf_counter, time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .. import glovar
+from .etc import code, get_readable_time, lang
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The sampled traces are not warnings, log them at the info level to the same file
+sampled = logging.getLogger(f"{__name__}.sampled")
+sampled.setLevel(logging.INFO)
+
+
+class Trace:
+    # Record each predicate of a decision with its result and cost, the actions taken, and the branch
+    def __init__(self, name: str, gid: int, uid: int, mid: int):
+        self.name = name
+        self.gid = gid
+        self.uid = uid
+        self.mid = mid
+        self.start = perf_counter()
+        self.results: Dict[str, Any] = {}
+        self.steps: List[Tuple[str, Union[bool, float, int], float, bool]] = []
+        self.actions: List[Tuple[str, Union[bool, float, int], float]] = []
+
+    def act(self, name: str, target: Callable, *args, **kwargs) -> Any:
+        # Run the action every time, it is not a predicate and its result is never cached
+        start = perf_counter()
+        result = target(*args, **kwargs)
+        self.actions.append((name, get_value(result), perf_counter() - start))
+
+        return result
+
+    def check(self, name: str, target: Callable, *args, **kwargs) -> Any:
+        # Run the predicate once, later checks of the same name get the cached result
+        if name in self.results:
+            result = self.results[name]
+            self.steps.append((name, get_value(result), 0.0, True))
+
+            return result
+
+        start = perf_counter()
+        result = self.results[name] = target(*args, **kwargs)
+        self.steps.append((name, get_value(result), perf_counter() - start, False))
+
+        return result
+
+    def finish(self, branch: str, done: bool) -> bool:
+        # Keep the trace for the test group, log it at the sampled rate
+        try:
+            trace = {
+                "name": self.name,
+                "gid": self.gid,
+                "uid": self.uid,
+                "mid": self.mid,
+                "time": int(time()),
+                "steps": self.steps,
+                "actions": self.actions,
+                "branch": branch,
+                "done": done,
+                "total": perf_counter() - self.start
+            }
+            glovar.traces.append(trace)
+
+            if glovar.trace_rate and random() < glovar.trace_rate:
+                sampled.info(get_trace_line(trace))
+
+            return True
+        except Exception as e:
+            logger.warning(f"Trace finish error: {e}", exc_info=True)
+
+        return False
+
+
+def get_trace(the_id: int = 0) -> Optional[dict]:
+    # Get the latest trace, or the latest one of the group, the user or the message
+    result = None
+    try:
+        for trace in reversed(list(glovar.traces)):
+            if not the_id or the_id in {trace["gid"], trace["uid"], trace["mid"]}:
+                return trace
+    except Exception as e:
+        logger.warning(f"Get trace error: {e}", exc_info=True)
+
+    return result
+
+
+def get_trace_line(trace: dict) -> str:
+    # Get the trace as one line for the log
+    result = ""
+    try:
+        steps = " ".join(f"{name}={value}:{secs * 1000:.3f}ms{(cached and ':cached') or ''}"
+                         for name, value, secs, cached in trace["steps"])
+        actions = "".join(f" action:{name}={value}:{secs * 1000:.3f}ms" for name, value, secs in trace["actions"])
+        result = (f"Trace {trace['name']} {trace['gid']} {trace['uid']} {trace['mid']} "
+                  f"branch={trace['branch']} done={trace['done']} total={trace['total'] * 1000:.3f}ms {steps}{actions}")
+    except Exception as e:
+        logger.warning(f"Get trace line error: {e}", exc_info=True)
+
+    return result
+
+
+def get_trace_text(trace: dict) -> str:
+    # Get the trace as the text for the test group
+    result = ""
+    try:
+        the_time = get_readable_time(trace["time"], "%Y/%m/%d %H:%M:%S")
+        total = f"{trace['total'] * 1000:.3f}ms"
+        result = (f"{lang('trace')}{lang('colon')}{code(trace['name'])}\n"
+                  f"{lang('group_id')}{lang('colon')}{code(trace['gid'])}\n"
+                  f"{lang('user_id')}{lang('colon')}{code(trace['uid'])}\n"
+                  f"{lang('trace_message')}{lang('colon')}{code(trace['mid'])}\n"
+                  f"{lang('trace_time')}{lang('colon')}{code(the_time)}\n"
+                  f"{lang('trace_branch')}{lang('colon')}{code(trace['branch'])}\n"
+                  f"{lang('trace_done')}{lang('colon')}{code(trace['done'])}\n"
+                  f"{lang('trace_total')}{lang('colon')}{code(total)}\n"
+                  f"{lang('trace_steps')}{lang('colon')}\n")
+
+        for name, value, secs, cached in trace["steps"]:
+            cached = (cached and f" {lang('trace_cached')}") or ""
+            result += f"{code(name)} {code(value)} {secs * 1000:.3f}ms{cached}\n"
+
+        if trace["actions"]:
+            result += f"{lang('trace_actions')}{lang('colon')}\n"
+
+        for name, value, secs in trace["actions"]:
+            result += f"{code(name)} {code(value)} {secs * 1000:.3f}ms\n"
+    except Exception as e:
+        logger.warning(f"Get trace text error: {e}", exc_info=True)
+
+    return result
+
+
+def get_value(result: Any) -> Union[bool, float, int]:
+    # Keep the numbers, reduce the other results to bool, so no text or message is kept
+    if isinstance(result, (bool, float, int)):
+        return result
+
+    return bool(result)
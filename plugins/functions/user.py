@@ -26,9 +26,10 @@ from .channel import ask_for_help, declare_message, forward_evidence, send_debug
 from .channel import share_watch_user, update_score
 from .file import save
 from .filters import is_class_d, is_declared_message, is_detected_user, is_high_score_user, is_limited_user, is_new_user
-from .filters import is_watch_user, is_wb_text
-from .ids import init_user_id
+from .filters import is_recorded_user, is_watch_user, is_wb_text
+from .ids import add_recorded_id, add_watch_id, init_user_id
 from .telegram import delete_message, kick_chat_member, restrict_chat_member
+from .trace import Trace
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -71,7 +72,7 @@ def add_watch_user(client: Bot, the_type: str, uid: int, now: int) -> bool:
     # Add a watch ban user, share it
     try:
         until = now + glovar.time_ban
-        glovar.watch_ids[the_type][uid] = until
+        add_watch_id(the_type, uid, until)
         until = str(until)
         until = crypt_str("encrypt", until, glovar.key)
         share_watch_user(client, the_type, uid, until)
@@ -104,20 +105,32 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
     try:
         result = None
 
-        # Check if it is necessary
-        if is_class_d(None, message) or is_declared_message(message):
-            return False
-
         gid = message.chat.id
         uid = message.from_user.id
         mid = message.message_id
+
+        # Record each check and the branch taken, see /trace in the test group
+        trace = Trace("terminate_user", gid, uid, mid)
+
+        # Check if it is necessary
+        if (trace.check("class_d", is_class_d, None, message)
+                or trace.check("declared", is_declared_message, message)):
+            trace.finish("skip", False)
+
+            return False
+
         now = int(message.date.strftime("%s")) or get_now()
 
-        full_name = get_full_name(message.from_user, True, True)
-        forward_name = get_forward_name(message, True, True)
+        full_name = trace.check("full_name", get_full_name, message.from_user, True, True)
+        forward_name = trace.check("forward_name", get_forward_name, message, True, True)
 
-        if (is_wb_text(full_name, False) or is_wb_text(forward_name, False)) and length != 79:
-            result = forward_evidence(
+        if ((trace.check("wb_name", is_wb_text, full_name, False)
+             or trace.check("wb_forward", is_wb_text, forward_name, False))
+                and length != 79):
+            branch = "name_ban"
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("auto_ban"),
@@ -139,8 +152,11 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     mid=mid,
                     em=result
                 )
-        elif is_watch_user(message.from_user, "ban", now) and length != 79:
-            result = forward_evidence(
+        elif trace.check("watch_ban", is_watch_user, message.from_user, "ban", now) and length != 79:
+            branch = "watch_ban"
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("auto_ban"),
@@ -162,9 +178,12 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     mid=mid,
                     em=result
                 )
-        elif is_high_score_user(message.from_user) and length != 79:
-            score = is_high_score_user(message.from_user)
-            result = forward_evidence(
+        elif trace.check("high_score", is_high_score_user, message.from_user) and length != 79:
+            branch = "score_ban"
+            score = trace.check("high_score", is_high_score_user, message.from_user)
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("auto_ban"),
@@ -187,8 +206,11 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     mid=mid,
                     em=result
                 )
-        elif is_watch_user(message.from_user, "delete", now) and length != 79:
-            result = forward_evidence(
+        elif trace.check("watch_delete", is_watch_user, message.from_user, "delete", now) and length != 79:
+            branch = "watch_delete"
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("global_delete"),
@@ -211,9 +233,12 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     mid=mid,
                     em=result
                 )
-        elif ((is_new_user(message.from_user, now, gid) and length > 2000)
-              or (is_limited_user(gid, message.from_user, now) and length > 1500)):
-            result = forward_evidence(
+        elif ((trace.check("new_user", is_new_user, message.from_user, now, gid) and length > 2000)
+              or (trace.check("limited_user", is_limited_user, gid, message.from_user, now) and length > 1500)):
+            branch = "op_upgrade"
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("global_delete"),
@@ -236,12 +261,18 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     mid=mid,
                     em=result
                 )
-        elif is_detected_user(message) or uid in glovar.recorded_ids[gid] or length == 79:
+        elif (trace.check("detected_user", is_detected_user, message)
+              or trace.check("recorded_user", is_recorded_user, gid, uid, now)
+              or length == 79):
+            branch = "repeat_delete"
             delete_message(client, gid, mid)
             add_detected_user(gid, uid, now)
             declare_message(client, gid, mid)
         else:
-            result = forward_evidence(
+            branch = "custom_delete"
+            result = trace.act(
+                "forward_evidence",
+                forward_evidence,
                 client=client,
                 message=message,
                 level=lang("auto_delete"),
@@ -251,7 +282,7 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
             )
 
             if result:
-                glovar.recorded_ids[gid].add(uid)
+                add_recorded_id(gid, uid, now)
                 delete_message(client, gid, mid)
                 declare_message(client, gid, mid)
                 previous = add_detected_user(gid, uid, now)
@@ -265,6 +296,9 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
                     em=result
                 )
 
+        # The repeated messages are deleted without new evidence
+        trace.finish(branch, bool(result) or branch == "repeat_delete")
+
         return bool(result)
     except Exception as e:
         logger.warning(f"Terminate user error: {e}", exc_info=True)
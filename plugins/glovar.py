@@ -19,13 +19,15 @@
 import logging
 import pickle
 from codecs import getdecoder
+from collections import deque
 from configparser import RawConfigParser
+from importlib.util import find_spec
 from os import mkdir
 from os.path import exists
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Union
+from threading import Event, Lock
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
 from telegram import Chat
@@ -46,10 +48,20 @@ enabled: Union[bool, str] = ""
 hostname: str = ""
 port: str = ""
 
+# [async]
+async_connections: int = 100
+async_enabled: Union[bool, str] = "False"
+async_workers: int = 16
+
 # [basic]
+batch_window: int = 0
 bot_token: str = ""
+debug: Union[bool, str] = "False"
+flight_size: int = 0
 prefix: List[str] = []
 prefix_str: str = "/!"
+queue_size: int = 0
+workers: int = 4
 
 # [bots]
 avatar_id: int = 0
@@ -76,6 +88,8 @@ long_channel_id: int = 0
 test_group_id: int = 0
 
 # [custom]
+admin_timeout: int = 30
+admin_workers: int = 8
 backup: Union[bool, str] = ""
 date_reset: str = ""
 default_group_link: str = ""
@@ -101,19 +115,80 @@ emoji_wb_total: int = 0
 key: Union[bytes, str] = ""
 password: str = ""
 
+# [metrics]
+metrics: Union[bool, str] = "False"
+metrics_listen: str = "127.0.0.1"
+metrics_port: int = 9079
+metrics_report: int = 60
+
+# [network]
+connect_timeout: float = 5.0
+pool_size: int = 0
+pool_timeout: float = 0.0
+read_timeout: float = 5.0
+
+# [process]
+process_timeout: float = 5.0
+process_workers: int = 0
+
+# [regex]
+regex_budget: float = 0.05
+regex_guard: Union[bool, str] = "False"
+regex_profile: Union[bool, str] = "False"
+regex_strikes: int = 3
+regex_top: int = 10
+
+# [sampler]
+sampler_interval: float = 0.01
+sampler_limit: int = 300
+sampler_time: int = 30
+
+# [shard]
+shard_count: int = 0
+shard_index: int = 0
+shard_listen: str = "127.0.0.1"
+shard_port: int = 8180
+
+# [trace]
+trace_keep: int = 100
+trace_rate: float = 0.01
+
+# [webhook]
+webhook: Union[bool, str] = "False"
+webhook_listen: str = "127.0.0.1"
+webhook_path: str = ""
+webhook_port: int = 8079
+webhook_url: str = ""
+
 try:
     config = RawConfigParser()
     config.read("config.ini")
 
+    # The sections added later are optional, an older config.ini does not have them
+    for section in ["async", "metrics", "network", "process", "regex", "sampler", "shard", "trace", "webhook"]:
+        config.has_section(section) or config.add_section(section)
+
     # [proxy]
     enabled = config["proxy"].get("enabled", enabled)
     enabled = eval(enabled)
     hostname = config["proxy"].get("hostname", hostname)
     port = config["proxy"].get("port", port)
 
+    # [async]
+    async_connections = int(config["async"].get("connections", str(async_connections)))
+    async_enabled = config["async"].get("enabled", async_enabled)
+    async_enabled = eval(async_enabled)
+    async_workers = int(config["async"].get("workers", str(async_workers)))
+
     # [basic]
+    batch_window = int(config["basic"].get("batch_window", str(batch_window)))
     bot_token = config["basic"].get("bot_token", bot_token)
+    debug = config["basic"].get("debug", debug)
+    debug = eval(debug)
+    flight_size = int(config["basic"].get("flight_size", str(flight_size)))
     prefix = list(config["basic"].get("prefix", prefix_str))
+    queue_size = int(config["basic"].get("queue_size", str(queue_size)))
+    workers = int(config["basic"].get("workers", str(workers)))
 
     # [bots]
     avatar_id = int(config["bots"].get("avatar_id", str(avatar_id)))
@@ -139,6 +214,8 @@ try:
     test_group_id = int(config["channels"].get("test_group_id", str(test_group_id)))
 
     # [custom]
+    admin_timeout = int(config["custom"].get("admin_timeout", str(admin_timeout)))
+    admin_workers = int(config["custom"].get("admin_workers", str(admin_workers)))
     backup = config["custom"].get("backup", backup)
     backup = eval(backup)
     date_reset = config["custom"].get("date_reset", date_reset)
@@ -167,6 +244,55 @@ try:
     key = config["encrypt"].get("key", key)
     key = key.encode("utf-8")
     password = config["encrypt"].get("password", password)
+
+    # [metrics]
+    metrics = config["metrics"].get("enabled", metrics)
+    metrics = eval(metrics)
+    metrics_listen = config["metrics"].get("listen", metrics_listen)
+    metrics_port = int(config["metrics"].get("port", str(metrics_port)))
+    metrics_report = int(config["metrics"].get("report", str(metrics_report)))
+
+    # [network]
+    connect_timeout = float(config["network"].get("connect_timeout", str(connect_timeout)))
+    pool_size = int(config["network"].get("pool_size", str(pool_size)))
+    pool_timeout = float(config["network"].get("pool_timeout", str(pool_timeout)))
+    read_timeout = float(config["network"].get("read_timeout", str(read_timeout)))
+
+    # [process]
+    process_timeout = float(config["process"].get("timeout", str(process_timeout)))
+    process_workers = int(config["process"].get("workers", str(process_workers)))
+
+    # [regex]
+    regex_budget = float(config["regex"].get("budget", str(regex_budget)))
+    regex_guard = config["regex"].get("guard", regex_guard)
+    regex_guard = eval(regex_guard)
+    regex_profile = config["regex"].get("profile", regex_profile)
+    regex_profile = eval(regex_profile)
+    regex_strikes = int(config["regex"].get("strikes", str(regex_strikes)))
+    regex_top = int(config["regex"].get("profile_top", str(regex_top)))
+
+    # [sampler]
+    sampler_interval = float(config["sampler"].get("interval", str(sampler_interval)))
+    sampler_limit = int(config["sampler"].get("limit", str(sampler_limit)))
+    sampler_time = int(config["sampler"].get("time", str(sampler_time)))
+
+    # [shard]
+    shard_count = int(config["shard"].get("count", str(shard_count)))
+    shard_index = int(config["shard"].get("index", str(shard_index)))
+    shard_listen = config["shard"].get("listen", shard_listen)
+    shard_port = int(config["shard"].get("port", str(shard_port)))
+
+    # [trace]
+    trace_keep = int(config["trace"].get("keep", str(trace_keep)))
+    trace_rate = float(config["trace"].get("rate", str(trace_rate)))
+
+    # [webhook]
+    webhook = config["webhook"].get("enabled", webhook)
+    webhook = eval(webhook)
+    webhook_listen = config["webhook"].get("listen", webhook_listen)
+    webhook_path = config["webhook"].get("path", webhook_path)
+    webhook_port = int(config["webhook"].get("port", str(webhook_port)))
+    webhook_url = config["webhook"].get("url", webhook_url)
 except Exception as e:
     logger.warning(f"Read data from config.ini error: {e}", exc_info=True)
 
@@ -174,8 +300,17 @@ except Exception as e:
 if (enabled not in {False, True}
         or hostname == ""
         or port == ""
+        or async_connections <= 0
+        or async_enabled not in {False, True}
+        or (async_enabled and enabled)
+        or async_workers <= 0
+        or batch_window < 0
         or bot_token in {"", "[DATA EXPUNGED]"}
+        or debug not in {False, True}
+        or flight_size < 0
         or prefix == []
+        or queue_size < 0
+        or workers < 0
         or avatar_id == 0
         or captcha_id == 0
         or clean_id == 0
@@ -194,6 +329,8 @@ if (enabled not in {False, True}
         or hide_channel_id == 0
         or logging_channel_id == 0
         or test_group_id == 0
+        or admin_timeout <= 0
+        or admin_workers <= 0
         or backup not in {False, True}
         or date_reset in {"", "[DATA EXPUNGED]"}
         or default_group_link in {"", "[DATA EXPUNGED]"}
@@ -213,7 +350,31 @@ if (enabled not in {False, True}
         or emoji_wb_single == 0
         or emoji_wb_total == 0
         or key in {b"", b"[DATA EXPUNGED]", "", "[DATA EXPUNGED]"}
-        or password in {"", "[DATA EXPUNGED]"}):
+        or password in {"", "[DATA EXPUNGED]"}
+        or metrics not in {False, True}
+        or (metrics and metrics_port == 0)
+        or metrics_report < 0
+        or connect_timeout <= 0
+        or pool_size < 0
+        or pool_timeout < 0
+        or read_timeout <= 0
+        or process_timeout <= 0
+        or process_workers < 0
+        or regex_budget <= 0
+        or regex_guard not in {False, True}
+        or (regex_guard and not find_spec("regex"))
+        or regex_profile not in {False, True}
+        or regex_strikes <= 0
+        or regex_top <= 0
+        or sampler_interval <= 0
+        or not 0 < sampler_time <= sampler_limit
+        or shard_count < 0
+        or (shard_count and not 0 <= shard_index < shard_count)
+        or (shard_count and (async_enabled or webhook))
+        or trace_keep <= 0
+        or not 0 <= trace_rate <= 1
+        or webhook not in {False, True}
+        or (webhook and (webhook_port == 0 or webhook_url in {"", "[DATA EXPUNGED]"}))):
     logger.critical("No proper settings")
     raise SystemExit("No proper settings")
 
@@ -224,6 +385,9 @@ if enabled:
 else:
     request_kwargs = None
 
+if not pool_size:
+    pool_size = workers + 4
+
 # Languages
 lang: Dict[str, str] = {
     # Admin
@@ -265,6 +429,12 @@ lang: Dict[str, str] = {
     "long_limit": (zh_cn and "消息字节上限") or "Bytes Length Limit",
     # Debug
     "triggered_by": (zh_cn and "触发消息") or "Triggered By",
+    # Metrics
+    "metrics": (zh_cn and "性能统计") or "Metrics",
+    "metrics_handler": (zh_cn and "处理耗时") or "Handlers",
+    "metrics_lock": (zh_cn and "锁等待") or "Lock Waits",
+    "metrics_queue": (zh_cn and "队列深度") or "Queue Depths",
+    "metrics_telegram": (zh_cn and "接口调用") or "Telegram Calls",
     # Emergency
     "issue": (zh_cn and "发现状况") or "Issue",
     "exchange_invalid": (zh_cn and "数据交换频道失效") or "Exchange Channel Invalid",
@@ -311,6 +481,33 @@ lang: Dict[str, str] = {
     "from_name": (zh_cn and "来源名称") or "Forward Name",
     "contact": (zh_cn and "联系方式") or "Contact Info",
     "more": (zh_cn and "附加信息") or "Extra Info",
+    # Regex
+    "regex_complex": (zh_cn and "规则存在嵌套重复") or "Nested Repeats in the Rule",
+    "regex_guard": (zh_cn and "规则超时保护") or "Rule Timeout Guard",
+    "regex_invalid": (zh_cn and "规则无法编译") or "Invalid Rule",
+    "regex_quarantine": (zh_cn and "已隔离") or "Quarantined",
+    "regex_timeout": (zh_cn and "多次超出时间预算") or "Exceeded the Time Budget Repeatedly",
+    "regex_type": (zh_cn and "规则类别") or "Rule Type",
+    "regex_watch": (zh_cn and "已加入超时保护") or "Guarded",
+    # Sampler
+    "sampler": (zh_cn and "堆栈采样") or "Stack Sampling",
+    "sampler_busy": (zh_cn and "已有采样正在进行") or "Another Sampling is Running",
+    "sampler_plugins": (zh_cn and "插件函数") or "Plugin Frames",
+    "sampler_samples": (zh_cn and "采样次数") or "Samples",
+    "sampler_self": (zh_cn and "栈顶函数") or "Self Frames",
+    "sampler_threads": (zh_cn and "线程数量") or "Threads",
+    "sampler_time": (zh_cn and "采样时长") or "Duration",
+    # Trace
+    "trace": (zh_cn and "决策追踪") or "Decision Trace",
+    "trace_actions": (zh_cn and "执行操作") or "Actions",
+    "trace_branch": (zh_cn and "所选分支") or "Branch",
+    "trace_cached": (zh_cn and "（缓存）") or "(cached)",
+    "trace_done": (zh_cn and "已执行") or "Done",
+    "trace_message": (zh_cn and "消息 ID") or "Message ID",
+    "trace_none": (zh_cn and "无追踪记录") or "No Trace",
+    "trace_steps": (zh_cn and "判断步骤") or "Steps",
+    "trace_time": (zh_cn and "记录时间") or "Time",
+    "trace_total": (zh_cn and "总耗时") or "Total",
     # Terminate
     "auto_ban": (zh_cn and "自动封禁") or "Auto Ban",
     "auto_delete": (zh_cn and "自动删除") or "Auto Delete",
@@ -341,17 +538,29 @@ all_commands: List[str] = [
     "version"
 ]
 
+batch_limit: int = 3000
+
 bot_ids: Set[int] = {avatar_id, captcha_id, clean_id, lang_id, long_id, noflood_id,
                      noporn_id, nospam_id, recheck_id, tip_id, user_id, warn_id}
 
-chats: Dict[int, Chat] = {}
+chats: Dict[int, Dict[str, Union[Chat, float]]] = {}
 # chats = {
-#     -10012345678: Chat
+#     -10012345678: {
+#         "chat": Chat,
+#         "time": 1512345678.0
+#     }
+# }
+
+chats_pending: Dict[int, Event] = {}
+# chats_pending = {
+#     -10012345678: Event
 # }
 
-declared_message_ids: Dict[int, Set[int]] = {}
+declared_message_ids: Dict[int, Dict[int, int]] = {}
 # declared_message_ids = {
-#     -10012345678: {123}
+#     -10012345678: {
+#         123: 1512345678
+#     }
 # }
 
 default_config: Dict[str, Union[bool, int]] = {
@@ -362,7 +571,7 @@ default_config: Dict[str, Union[bool, int]] = {
     "limit": 9000
 }
 
-default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
+default_user_status: Dict[str, Union[Dict[Union[int, str], Union[float, int]], float]] = {
     "detected": {},
     "join": {},
     "score": {
@@ -375,21 +584,80 @@ default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
         "nospam": 0.0,
         "recheck": 0.0,
         "warn": 0.0
-    }
+    },
+    "total": 0.0
 }
 
 emoji_set: Set[str] = set(UNICODE_EMOJI)
 
+exchange_batch: Dict[Tuple[Tuple[str, ...], str, str], Dict[Any, dict]] = {}
+
 left_group_ids: Set[int] = set()
 
+limit_chat: int = 5000
+
+limit_declare: int = 1000
+
+limit_join: int = max(limit_track, 100)
+
+limit_name: int = 10000
+
 locks: Dict[str, Lock] = {
     "admin": Lock(),
+    "chat": Lock(),
+    "exchange": Lock(),
     "message": Lock(),
+    "metrics": Lock(),
     "receive": Lock(),
     "regex": Lock(),
-    "test": Lock()
+    "test": Lock(),
+    "trust": Lock(),
+    "watch": Lock()
 }
 
+long_stats: Dict[str, int] = {}
+# long_stats = {
+#     "bound": 0
+# }
+
+metric_buckets: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+metric_reported: Dict[str, Dict[str, Dict[str, Union[float, int, List[int]]]]] = {}
+
+metric_stats: Dict[str, Dict[str, Dict[str, Union[float, int, List[int]]]]] = {}
+# metric_stats = {
+#     "handler": {
+#         "check": {
+#             "buckets": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+#             "count": 0,
+#             "errors": 0,
+#             "sum": 0.0
+#         }
+#     }
+# }
+
+names: Dict[str, bool] = {}
+# names = {
+#     "name": False
+# }
+
+network_stats: Dict[str, Union[float, int]] = {
+    "requests": 0,
+    "in_flight": 0,
+    "in_flight_max": 0,
+    "waited": 0,
+    "overflow": 0,
+    "wait_time": 0.0,
+    "wait_max": 0.0
+}
+
+process_hits: Optional[List[Tuple[str, tuple]]] = None
+# process_hits = [
+#     ("count_word", ("del", "regex")),
+#     ("count_regex", ("del", [("regex", 0.001)], "text")),
+#     ("strike_regex", ("del", "regex"))
+# ]
+
 receivers: Dict[str, List[str]] = {
     "bad": ["ANALYZE", "APPLY", "AVATAR", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
             "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TICKET", "TIP", "USER", "WARN", "WATCH"],
@@ -401,9 +669,11 @@ receivers: Dict[str, List[str]] = {
               "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TIP", "USER", "WARN", "WATCH"]
 }
 
-recorded_ids: Dict[int, Set[int]] = {}
+recorded_ids: Dict[int, Dict[int, int]] = {}
 # recorded_ids = {
-#     -10012345678: {12345678}
+#     -10012345678: {
+#         12345678: 1512345678
+#     }
 # }
 
 regex: Dict[str, bool] = {
@@ -424,12 +694,83 @@ regex: Dict[str, bool] = {
 for c in ascii_lowercase:
     regex[f"ad{c}"] = False
 
+regex_quarantine: Dict[str, Set[str]] = {}
+# regex_quarantine = {
+#     "del": {"regex"}
+# }
+
+regex_reports: List[Tuple[str, str, str]] = []
+# regex_reports = [
+#     ("del", "regex", "timeout")
+# ]
+
+regex_stats: Dict[str, Dict[str, Dict[str, Union[float, int, str]]]] = {}
+# regex_stats = {
+#     "del": {
+#         "regex": {
+#             "count": 0,
+#             "time": 0.0,
+#             "max": 0.0,
+#             "input": "3a7bd3e2360a3d29",
+#             "length": 0
+#         }
+#     }
+# }
+
+regex_timeouts: Dict[str, Dict[str, int]] = {}
+# regex_timeouts = {
+#     "del": {
+#         "regex": 0
+#     }
+# }
+
+route_stats: Dict[Tuple[str, str, str], Dict[str, Union[float, int]]] = {}
+# route_stats = {
+#     ("MANAGE", "update", "refresh"): {
+#         "count": 0,
+#         "time": 0.0,
+#         "max": 0.0
+#     }
+# }
+
 sender: str = "LONG"
 
 should_hide: bool = False
 
+time_chat: int = 3600
+
+time_declare: int = 300
+
+time_join: int = max(time_new, time_short, time_track)
+
+time_recorded: int = 600
+
+traces: Deque[Dict[str, Any]] = deque(maxlen=trace_keep)
+# traces = deque([{
+#     "name": "terminate_user",
+#     "gid": -10012345678,
+#     "uid": 12345678,
+#     "mid": 123,
+#     "time": 1512345678,
+#     "steps": [("watch_ban", False, 0.00001, False)],
+#     "actions": [("forward_evidence", True, 0.3)],
+#     "branch": "custom_delete",
+#     "done": True,
+#     "total": 0.5
+# }])
+
+trusted_ids: Dict[int, Set[int]] = {}
+# trusted_ids = {
+#     12345678: {-10012345678}
+# }
+
 version: str = "0.1.3"
 
+watch_heap: List[Tuple[int, str, int]] = []
+# watch_heap = [
+#     (1512345678, "ban", 12345678)
+# ]
+
 # Load data from pickle
 
 # Init dir
@@ -470,7 +811,7 @@ trust_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
-user_ids: Dict[int, Dict[str, Dict[Union[int, str], Union[float, int]]]] = {}
+user_ids: Dict[int, Dict[str, Union[Dict[Union[int, str], Union[float, int]], float]]] = {}
 # user_ids = {
 #     12345678: {
 #         "detected": {
@@ -489,7 +830,8 @@ user_ids: Dict[int, Dict[str, Dict[Union[int, str], Union[float, int]]]] = {}
 #             "nospam": 0.0,
 #             "recheck": 0.0,
 #             "warn": 0.0
-#         }
+#         },
+#         "total": 0.0
 #     }
 # }
 
@@ -31,7 +31,9 @@ from ..functions.etc import get_readable_time, lang, thread, mention_id
 from ..functions.file import save
 from ..functions.filters import authorized_group, captcha_group, from_user, is_class_c, test_group
 from ..functions.group import get_config_text
+from ..functions.sampler import send_profile
 from ..functions.telegram import delete_message, get_group_info, send_message, send_report_message
+from ..functions.trace import get_trace, get_trace_text
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -69,6 +71,26 @@ def add_command_handlers(dispatcher: Dispatcher) -> bool:
                      & from_user)
         ))
 
+        # /profile
+        dispatcher.add_handler(PrefixHandler(
+            prefix=glovar.prefix,
+            command=["profile"],
+            callback=profile,
+            filters=(Filters.update.messages & Filters.group
+                     & test_group
+                     & from_user)
+        ))
+
+        # /trace
+        dispatcher.add_handler(PrefixHandler(
+            prefix=glovar.prefix,
+            command=["trace"],
+            callback=trace,
+            filters=(Filters.update.messages & Filters.group
+                     & test_group
+                     & from_user)
+        ))
+
         # /version
         dispatcher.add_handler(PrefixHandler(
             prefix=glovar.prefix,
@@ -279,6 +301,83 @@ def long(update: Update, context: CallbackContext) -> bool:
     return False
 
 
+def profile(update: Update, context: CallbackContext) -> bool:
+    # Sample the stacks of the running bot, such as /profile long 60
+    result = False
+
+    try:
+        client = context.bot
+        message = update.edited_message or update.message
+
+        # Basic data
+        cid = message.chat.id
+        aid = message.from_user.id
+        mid = message.message_id
+
+        # Get the command type and the seconds
+        command_type, command_context = get_command_context(message)
+
+        if command_type and not command_type.isdigit():
+            # The command is for another bot
+            if command_type.upper() != glovar.sender:
+                return True
+
+            command_type = command_context
+
+        secs = (command_type.isdigit() and int(command_type)) or glovar.sampler_time
+        secs = min(secs, glovar.sampler_limit)
+
+        # Do not block the dispatcher while sampling
+        result = thread(send_profile, (client, secs, aid, cid, mid))
+    except Exception as e:
+        logger.warning(f"Profile error: {e}", exc_info=True)
+
+    return result
+
+
+def trace(update: Update, context: CallbackContext) -> bool:
+    # Show the latest decision trace, or the latest one of a group, user or message, such as /trace long 12345678
+    result = False
+
+    try:
+        client = context.bot
+        message = update.edited_message or update.message
+
+        # Basic data
+        cid = message.chat.id
+        aid = message.from_user.id
+        mid = message.message_id
+
+        # Get the command type and the id
+        command_type, command_context = get_command_context(message)
+
+        if command_type and not re.search(r"^-?[0-9]+$", command_type):
+            # The command is for another bot
+            if command_type.upper() != glovar.sender:
+                return True
+
+            command_type = command_context
+
+        the_id = (re.search(r"^-?[0-9]+$", command_type) and int(command_type)) or 0
+        the_trace = get_trace(the_id)
+
+        # Generate the text
+        text = f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
+
+        if the_trace:
+            text += get_trace_text(the_trace)
+        else:
+            text += (f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
+                     f"{lang('reason')}{lang('colon')}{code(lang('trace_none'))}\n")
+
+        # Send the report message
+        result = send_message(client, cid, text, mid)
+    except Exception as e:
+        logger.warning(f"Trace error: {e}", exc_info=True)
+
+    return result
+
+
 def version(update: Update, context: CallbackContext) -> bool:
     # Check the program's version
     result = False
@@ -29,15 +29,12 @@ from ..functions.filters import authorized_group, captcha_group, class_c, class_
 from ..functions.filters import from_user, hide_channel, is_class_d_user, is_declared_message, is_long_text, is_nm_text
 from ..functions.filters import new_group, test_group
 from ..functions.group import leave_group
-from ..functions.ids import init_group_id, init_user_id
-from ..functions.receive import receive_add_bad, receive_add_except, receive_clear_data, receive_config_commit
-from ..functions.receive import receive_config_reply, receive_config_show, receive_declared_message
-from ..functions.receive import receive_leave_approve, receive_refresh, receive_regex, receive_remove_bad
-from ..functions.receive import receive_remove_except, receive_remove_score, receive_remove_watch, receive_rollback
-from ..functions.receive import receive_text_data, receive_user_score, receive_watch_user
-from ..functions.telegram import delete_message, get_admins, get_chat_member, send_message
+from ..functions.ids import add_join_id, init_group_id, init_user_id, set_trust_ids
+from ..functions.receive import receive_text_data
+from ..functions.route import route_data
+from ..functions.shard import sync_trust
+from ..functions.telegram import delete_message, get_admins, get_chat_member, send_message, update_chat_cache
 from ..functions.tests import long_test
-from ..functions.timers import backup_files, send_count
 from ..functions.user import terminate_user
 
 # Enable logging
@@ -103,6 +100,13 @@ def add_message_handlers(dispatcher: Dispatcher) -> bool:
             callback=test
         ))
 
+        # Update chat
+        dispatcher.add_handler(MessageHandler(
+            filters=(Filters.group & Filters.status_update.new_chat_title
+                     & ~captcha_group & ~test_group & authorized_group),
+            callback=update_chat
+        ))
+
         return True
     except Exception as e:
         logger.warning(f"Add message handlers error: {e}", exc_info=True)
@@ -150,6 +154,9 @@ def check(update: Update, context: CallbackContext) -> bool:
         client = context.bot
         message = update.effective_message
 
+        # Check the cached chat
+        update_chat_cache(message.chat)
+
         # Check declare status
         if is_declared_message(message):
             return True
@@ -205,7 +212,7 @@ def check_join(update: Update, context: CallbackContext) -> bool:
                 continue
 
             # Update user's join status
-            glovar.user_ids[uid]["join"][gid] = now
+            add_join_id(gid, uid, now)
             save("user_ids")
 
         return True
@@ -297,8 +304,9 @@ def init_group(update: Update, context: CallbackContext) -> bool:
                 save("admin_ids")
 
                 # Trust list
-                glovar.trust_ids[gid] = {admin.user.id for admin in admin_members}
+                set_trust_ids(gid, {admin.user.id for admin in admin_members})
                 save("trust_ids")
+                sync_trust([gid])
 
                 # Get bot admins
                 chat_member = get_chat_member(client, gid, glovar.nospam_id)
@@ -354,174 +362,9 @@ def process_data(update: Update, context: CallbackContext) -> bool:
         action_type = data["type"]
         data = data["data"]
 
-        # This will look awkward,
-        # seems like it can be simplified,
-        # but this is to ensure that the permissions are clear,
-        # so it is intentionally written like this
+        # The permissions are listed in the routing table
         if glovar.sender in receivers:
-
-            if sender == "CAPTCHA":
-
-                if action == "update":
-                    if action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CLEAN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CONFIG":
-
-                if action == "config":
-                    if action_type == "commit":
-                        receive_config_commit(data)
-                    elif action_type == "reply":
-                        receive_config_reply(client, data)
-
-            elif sender == "LANG":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "MANAGE":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "except":
-                        receive_add_except(data)
-
-                elif action == "backup":
-                    if action_type == "now":
-                        thread(backup_files, (client,))
-                    elif action_type == "rollback":
-                        receive_rollback(client, message, data)
-
-                elif action == "clear":
-                    receive_clear_data(client, action_type, data)
-
-                elif action == "config":
-                    if action_type == "show":
-                        receive_config_show(client, data)
-
-                elif action == "leave":
-                    if action_type == "approve":
-                        receive_leave_approve(client, data)
-
-                elif action == "remove":
-                    if action_type == "bad":
-                        receive_remove_bad(data)
-                    elif action_type == "except":
-                        receive_remove_except(data)
-                    elif action_type == "score":
-                        receive_remove_score(data)
-                    elif action_type == "watch":
-                        receive_remove_watch(data)
-
-                elif action == "update":
-                    if action_type == "refresh":
-                        receive_refresh(client, data)
-
-            elif sender == "NOFLOOD":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOPORN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOSPAM":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "RECHECK":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "REGEX":
-
-                if action == "regex":
-                    if action_type == "update":
-                        receive_regex(client, message, data)
-                    elif action_type == "count":
-                        if data == "ask":
-                            send_count(client)
-
-            elif sender == "USER":
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-
-            elif sender == "WARN":
-
-                if action == "update":
-                    if action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "WATCH":
-
-                if action == "add":
-                    if action_type == "watch":
-                        receive_watch_user(data)
+            route_data(client, message, sender, action, action_type, data)
 
         return True
     except Exception as e:
@@ -548,3 +391,17 @@ def test(update: Update, context: CallbackContext) -> bool:
         glovar.locks["test"].release()
 
     return False
+
+
+def update_chat(update: Update, context: CallbackContext) -> bool:
+    # Invalidate the cached chat when the group's title changes
+    try:
+        message = update.effective_message
+
+        update_chat_cache(message.chat)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update chat error: {e}", exc_info=True)
+
+    return False
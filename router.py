@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from telegram import Bot
+
+from plugins import glovar
+from plugins.functions.session import PooledRequest
+from plugins.functions.shard import run_router
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The sharded mode, this front process receives the updates and routes them to the shards by the chat id
+if not glovar.shard_count:
+    raise SystemExit("The router requires the [shard] settings")
+
+# Config session
+bot = Bot(
+    token=glovar.bot_token,
+    request=PooledRequest(
+        con_pool_size=glovar.pool_size,
+        connect_timeout=glovar.connect_timeout,
+        read_timeout=glovar.read_timeout + 10,
+        pool_timeout=glovar.pool_timeout,
+        **(glovar.request_kwargs or {})
+    )
+)
+
+# Hold
+run_router(bot)
@@ -0,0 +1,339 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sys
+from base64 import urlsafe_b64encode
+from collections import deque
+from configparser import RawConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from os import chdir
+from os.path import abspath, dirname, join
+from tempfile import mkdtemp
+from threading import Condition, Lock, Thread
+from time import sleep, time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# A token in the format accepted by python-telegram-bot
+token: str = "123456789:FAKE-LONG-TOKEN"
+
+bot_user: Dict[str, Any] = {
+    "id": 123456789,
+    "is_bot": True,
+    "first_name": "LONG",
+    "username": "scp_079_long_bot"
+}
+
+
+# The ids in the fake config.ini
+config_ids: Dict[str, Dict[str, int]] = {
+    "bots": {
+        "avatar_id": 100000001,
+        "captcha_id": 100000002,
+        "clean_id": 100000003,
+        "lang_id": 100000004,
+        "long_id": bot_user["id"],
+        "noflood_id": 100000005,
+        "noporn_id": 100000006,
+        "nospam_id": 100000007,
+        "recheck_id": 100000008,
+        "tip_id": 100000009,
+        "user_id": 100000010,
+        "warn_id": 100000011
+    },
+    "channels": {
+        "captcha_group_id": -1001000000001,
+        "critical_channel_id": -1001000000002,
+        "debug_channel_id": -1001000000003,
+        "exchange_channel_id": -1001000000004,
+        "hide_channel_id": -1001000000005,
+        "logging_channel_id": -1001000000006,
+        "long_channel_id": 0,
+        "test_group_id": -1001000000007
+    }
+}
+
+# The root of the repository
+root: str = dirname(dirname(abspath(__file__)))
+
+
+class FakeApi:
+    # A local stand-in for the Bot API, records the calls and simulates latency
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Tuple[float, str, dict]] = []
+        self.lock = Lock()
+        self.message_id = 0
+        self.updates = deque()
+        self.updates_ready = Condition()
+
+    def add_updates(self, updates: List[dict]):
+        # Queue updates for getUpdates
+        with self.updates_ready:
+            self.updates.extend(updates)
+            self.updates_ready.notify_all()
+
+    def call(self, method: str, params: dict) -> Any:
+        # Answer a Bot API method
+        with self.lock:
+            self.calls.append((time(), method, params))
+
+        if method == "getUpdates":
+            return self.get_updates(params)
+
+        self.latency and sleep(self.latency)
+
+        if method == "getMe":
+            return bot_user
+
+        if method in {"sendMessage", "sendDocument", "forwardMessage"}:
+            return self.get_message(params)
+
+        if method == "getChat":
+            return self.get_chat(params.get("chat_id"))
+
+        if method == "getChatAdministrators":
+            return [
+                {"user": bot_user, "status": "administrator",
+                 "can_delete_messages": True, "can_restrict_members": True},
+                {"user": {"id": 1, "is_bot": False, "first_name": "Creator"}, "status": "creator"}
+            ]
+
+        if method == "getChatMember":
+            return {"user": {"id": int(params.get("user_id", 0)), "is_bot": True, "first_name": "Bot"},
+                    "status": "administrator"}
+
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_size": 0, "file_path": "fake"}
+
+        return True
+
+    def count(self) -> Dict[str, int]:
+        # Count the recorded calls by method
+        result = {}
+
+        with self.lock:
+            for _, method, _ in self.calls:
+                result[method] = result.get(method, 0) + 1
+
+        return result
+
+    def get_chat(self, cid: Any) -> dict:
+        # Get a fake group
+        cid = int(cid or 0)
+        return {"id": cid, "type": "supergroup", "title": f"Group {cid}"}
+
+    def get_message(self, params: dict) -> dict:
+        # Get a fake sent message
+        with self.lock:
+            self.message_id += 1
+            mid = self.message_id
+
+        cid = int(params.get("chat_id", 0) or 0)
+
+        return {
+            "message_id": mid,
+            "date": int(time()),
+            "chat": {"id": cid, "type": "channel" if cid < -1000000000000 else "supergroup"},
+            "text": params.get("text") or params.get("caption") or ""
+        }
+
+    def get_updates(self, params: dict) -> List[dict]:
+        # Long polling
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        timeout = min(float(params.get("timeout", 0) or 0), 1.0)
+
+        with self.updates_ready:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+
+            if not self.updates and timeout:
+                self.updates_ready.wait(timeout)
+
+            return [self.updates[i] for i in range(min(limit, len(self.updates)))]
+
+
+class FakeRequest:
+    # Replace telegram.utils.request.Request, answer the calls with a FakeApi in process
+    def __init__(self, api: FakeApi, con_pool_size: int = 1):
+        self.api = api
+        self._con_pool_size = con_pool_size
+
+    @property
+    def con_pool_size(self) -> int:
+        return self._con_pool_size
+
+    def download(self, url: str, filename: str, timeout: float = None):
+        with open(filename, "wb") as f:
+            f.write(self.retrieve(url, timeout))
+
+    def get(self, url: str, timeout: float = None) -> Any:
+        return self.post(url, {}, timeout)
+
+    def post(self, url: str, data: dict, timeout: float = None) -> Any:
+        method = url.rsplit("/", 1)[-1]
+        return self.api.call(method, data)
+
+    def retrieve(self, url: str, timeout: float = None) -> bytes:
+        self.api.call("download", {"url": url})
+        return b""
+
+    def stop(self):
+        pass
+
+
+class FakeServer:
+    # Serve a FakeApi over HTTP, so the unmodified Request can talk to it
+    def __init__(self, api: FakeApi, port: int = 0):
+        self.api = api
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.get_handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}/bot"
+
+    def get_handler(self):
+        api = self.api
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.answer({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                body = self.rfile.read(length)
+                params = {}
+
+                if "application/json" in self.headers.get("Content-Type", ""):
+                    params = loads(body or b"{}")
+
+                self.answer(params)
+
+            def answer(self, params: dict):
+                if self.path.startswith("/file/"):
+                    api.call("download", {"url": self.path})
+                    data = b""
+                else:
+                    method = self.path.rsplit("/", 1)[-1]
+                    data = dumps({"ok": True, "result": api.call(method, params)}).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def get_channel_post_update(update_id: int, cid: int, text: str, now: int = 0) -> dict:
+    # Get a channel post update, such as the data in the exchange channel
+    return {
+        "update_id": update_id,
+        "channel_post": {
+            "message_id": update_id,
+            "date": now or int(time()),
+            "chat": {"id": cid, "type": "channel", "title": f"Channel {cid}"},
+            "text": text
+        }
+    }
+
+
+def get_join_update(update_id: int, gid: int, uid: int, now: int = 0) -> dict:
+    # Get a new chat members update
+    user = {"id": uid, "is_bot": False, "first_name": f"User {uid}"}
+
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": now or int(time()),
+            "chat": {"id": gid, "type": "supergroup", "title": f"Group {gid}"},
+            "from": user,
+            "new_chat_members": [user]
+        }
+    }
+
+
+def get_message_update(update_id: int, gid: int, uid: int, text: str, now: int = 0,
+                       forward_chat: Dict[str, Any] = None) -> dict:
+    # Get a group message update
+    update = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": now or int(time()),
+            "chat": {"id": gid, "type": "supergroup", "title": f"Group {gid}"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"User {uid}"},
+            "text": text
+        }
+    }
+
+    if forward_chat:
+        update["message"]["forward_from_chat"] = forward_chat
+        update["message"]["forward_date"] = update["message"]["date"]
+
+    return update
+
+
+def prepare(path: str = "", overrides: Dict[str, Dict[str, str]] = None) -> str:
+    # Write a fake config.ini to a temporary directory and work there, must be called before importing plugins
+    path = path or mkdtemp(prefix="long-")
+
+    config = RawConfigParser()
+    config.read(join(root, "config.ini.example"))
+    config.set("basic", "bot_token", token)
+    config.set("custom", "zh_cn", "False")
+    config.set("encrypt", "key", urlsafe_b64encode(b"0" * 32).decode("utf-8"))
+    config.set("encrypt", "password", "fake")
+
+    for section in config_ids:
+        for key, value in config_ids[section].items():
+            config.set(section, key, str(value))
+
+    for section in overrides or {}:
+        for key, value in overrides[section].items():
+            config.set(section, key, value)
+
+    with open(join(path, "config.ini"), "w") as f:
+        config.write(f)
+
+    chdir(path)
+    root not in sys.path and sys.path.insert(0, root)
+
+    return path
@@ -0,0 +1,163 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compare the update intake rate of long polling and webhook against a local fake Bot API:
+#
+#     python -m tools.intake --updates 20000 --posters 16 --flight 64
+#
+# The updater is built by session.get_updater, so the runs go through the
+# bounded dispatcher with the workers, the queue size and the flight size.
+
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from json import dumps
+from socket import socket
+from threading import Event, Lock
+from time import sleep, time
+
+from tools.fake import FakeApi, FakeRequest, get_message_update, prepare, token
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    # Count processed updates, set the event when all of them are done
+    def __init__(self, total: int):
+        self.total = total
+        self.count = 0
+        self.lock = Lock()
+        self.done = Event()
+
+    def callback(self, update, context):
+        with self.lock:
+            self.count += 1
+
+            if self.count >= self.total:
+                self.done.set()
+
+
+def free_port() -> int:
+    # Get a free local port
+    with socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_updater(api: FakeApi, counter: Counter):
+    # Get the bot's updater with a fake request, count the processed updates
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    from plugins import glovar
+    from plugins.functions.session import get_updater as get_bot_updater
+
+    updater = get_bot_updater(token, FakeRequest(api, glovar.workers + 4))
+    updater.dispatcher.add_handler(TypeHandler(Update, counter.callback))
+
+    return updater
+
+
+def get_updates(total: int) -> list:
+    # Get synthetic group messages
+    return [get_message_update(i + 1, -1001000000000 - i % 50, 1000 + i % 500, f"message {i}")
+            for i in range(total)]
+
+
+def run_polling(total: int) -> float:
+    # Measure the intake rate of long polling
+    api = FakeApi()
+    counter = Counter(total)
+    updater = get_updater(api, counter)
+
+    try:
+        api.add_updates(get_updates(total))
+        start = time()
+        updater.start_polling(poll_interval=0.0, timeout=1)
+        counter.done.wait(600)
+        secs = time() - start
+    finally:
+        updater.stop()
+
+    return counter.count / secs
+
+
+def run_webhook(total: int, posters: int) -> float:
+    # Measure the intake rate of the webhook listener
+    api = FakeApi()
+    counter = Counter(total)
+    updater = get_updater(api, counter)
+    port = free_port()
+    updates = get_updates(total)
+
+    def post(part: list):
+        connection = HTTPConnection("127.0.0.1", port)
+
+        for data in part:
+            body = dumps(data)
+            connection.request("POST", "/hook", body, {"Content-Type": "application/json"})
+            connection.getresponse().read()
+
+        connection.close()
+
+    try:
+        updater.start_webhook(listen="127.0.0.1", port=port, url_path="hook",
+                              webhook_url="https://example.com/hook")
+        sleep(1)
+        start = time()
+
+        with ThreadPoolExecutor(max_workers=posters) as executor:
+            for i in range(posters):
+                executor.submit(post, updates[i::posters])
+
+        counter.done.wait(600)
+        secs = time() - start
+    finally:
+        updater.stop()
+
+    return counter.count / secs
+
+
+def main():
+    parser = ArgumentParser(description="Compare the update intake rate of polling and webhook")
+    parser.add_argument("--updates", type=int, default=10000, help="number of updates in each run")
+    parser.add_argument("--workers", type=int, default=4, help="dispatcher workers")
+    parser.add_argument("--queue", type=int, default=0, help="update queue size, 0 means unbounded")
+    parser.add_argument("--flight", type=int, default=0, help="updates in flight, 0 means unbounded")
+    parser.add_argument("--posters", type=int, default=8, help="concurrent webhook connections")
+    args = parser.parse_args()
+
+    prepare(overrides={
+        "basic": {
+            "flight_size": str(args.flight),
+            "queue_size": str(args.queue),
+            "workers": str(args.workers)
+        }
+    })
+
+    polling = run_polling(args.updates)
+    print(f"polling: {polling:.0f} updates/s")
+
+    webhook = run_webhook(args.updates, args.posters)
+    print(f"webhook: {webhook:.0f} updates/s")
+
+
+if __name__ == "__main__":
+    main()
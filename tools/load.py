@@ -0,0 +1,311 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Drive the handlers with synthetic spam waves against a local fake Bot API:
+#
+#     python -m tools.load --groups 200 --users 5000 --rate 500 --duration 30
+#     python -m tools.load --mix chatter=50,long=20,raid=10,forward=10,exchange=10
+#
+# The report shows the end-to-end latency in each quarter of the run,
+# and where the time goes: lock waits, regex, saves and outbound threads.
+
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from random import Random
+from threading import Event, Lock, Thread, active_count, local
+from time import perf_counter, sleep
+from typing import Callable, Dict, List, Optional
+
+from tools.fake import FakeApi, config_ids, get_channel_post_update, get_join_update, get_message_update, prepare
+from tools.replay import Recorder, get_dispatcher, percentile, print_report, seed_groups, wait_threads
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The default traffic mix, in percent
+default_mix: Dict[str, int] = {
+    "chatter": 70,
+    "long": 10,
+    "raid": 5,
+    "forward": 5,
+    "exchange": 10
+}
+
+
+class LockProbe:
+    # Replace a lock, record the time spent waiting for it
+    def __init__(self, lock: Lock):
+        self.lock = lock
+        self.waits: List[float] = []
+        self.stats = Lock()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = perf_counter()
+        result = self.lock.acquire(blocking, timeout)
+
+        with self.stats:
+            self.waits.append(perf_counter() - start)
+
+        return result
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def release(self):
+        self.lock.release()
+
+
+class Probe:
+    # Wrap a function, record the time spent in its outermost calls
+    def __init__(self):
+        self.times: List[float] = []
+        self.lock = Lock()
+        self.depth = local()
+
+    def wrap(self, target: Callable) -> Callable:
+        def wrapped(*args, **kwargs):
+            depth = getattr(self.depth, "value", 0)
+            self.depth.value = depth + 1
+            start = perf_counter()
+
+            try:
+                return target(*args, **kwargs)
+            finally:
+                self.depth.value = depth
+
+                if not depth:
+                    with self.lock:
+                        self.times.append(perf_counter() - start)
+
+        wrapped.__name__ = target.__name__
+
+        return wrapped
+
+
+class ThreadSampler:
+    # Sample the number of live threads, the outbound calls run in short-lived threads
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[int] = []
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append(active_count())
+            sleep(self.interval)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def get_long_text(rng: Random, size: int) -> str:
+    # Get a text of about size bytes
+    if rng.random() < 0.5:
+        return ("spam link t.me/example " * (size // 23 + 1))[:size]
+
+    return ("超长广告消息" * (size // 18 + 1))[:size // 3]
+
+
+def get_mix(text: str) -> Dict[str, int]:
+    # Parse the traffic mix, such as chatter=70,long=10
+    mix = dict(default_mix)
+
+    for part in filter(None, text.split(",")):
+        kind, percent = part.split("=")
+        mix[kind.strip()] = int(percent)
+
+    return mix
+
+
+def get_traffic(total: int, groups: int, users: int, mix: Dict[str, int], seed: int = 79) -> List[dict]:
+    # Get the synthetic updates
+    rng = Random(seed)
+    gids = [-1002000000000 - i for i in range(groups)]
+    kinds = [kind for kind, percent in mix.items() for _ in range(percent)]
+    exchange_id = config_ids["channels"]["exchange_channel_id"]
+    raiders = []
+    updates = []
+    update_id = 0
+    new_uid = 10 ** 9
+
+    while len(updates) < total:
+        update_id += 1
+        kind = rng.choice(kinds)
+        gid = rng.choice(gids)
+        uid = 10000 + rng.randrange(users)
+
+        if kind == "chatter":
+            updates.append(get_message_update(update_id, gid, uid, f"hello {update_id}"))
+        elif kind == "long":
+            size = rng.choice([2000, 5000, 9500, 12000])
+            updates.append(get_message_update(update_id, gid, uid, get_long_text(rng, size)))
+        elif kind == "raid":
+            # A new user joins, and sends a long message later
+            if raiders and rng.random() < 0.5:
+                gid, uid = raiders.pop()
+                updates.append(get_message_update(update_id, gid, uid, get_long_text(rng, 3000)))
+            else:
+                new_uid += 1
+                raiders.append((gid, new_uid))
+                updates.append(get_join_update(update_id, gid, new_uid))
+        elif kind == "forward":
+            chat = {"id": -1003000000000 - rng.randrange(10), "type": "channel", "title": "Spam Channel"}
+            updates.append(get_message_update(update_id, gid, uid, get_long_text(rng, 9500), forward_chat=chat))
+        elif kind == "exchange":
+            if rng.random() < 0.5:
+                data = {"group_id": gid, "message_id": rng.randrange(update_id + 1)}
+                action_type = "declare"
+            else:
+                data = {"id": uid, "score": round(rng.random() * 3, 1)}
+                action_type = "score"
+
+            text = dumps({"from": "NOSPAM", "to": ["LONG"], "action": "update", "type": action_type, "data": data})
+            updates.append(get_channel_post_update(update_id, exchange_id, text))
+
+    return updates
+
+
+def install_probes() -> Dict[str, object]:
+    # Measure the locks, the regex rules and the saves
+    from plugins import glovar
+    from plugins.functions import file, filters
+
+    probes = {}
+
+    for name in ["message", "receive", "regex"]:
+        probes[f"lock {name}"] = glovar.locks[name] = LockProbe(glovar.locks[name])
+
+    probes["regex"] = Probe()
+    filters.is_regex_text = probes["regex"].wrap(filters.is_regex_text)
+
+    probes["save"] = Probe()
+    file.save_thread = probes["save"].wrap(file.save_thread)
+
+    return probes
+
+
+def print_probes(probes: Dict[str, object], sampler: ThreadSampler) -> bool:
+    # Print where the time goes
+    print()
+    print(f"{'probe':<20}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+    for name, probe in probes.items():
+        times = sorted(probe.waits if isinstance(probe, LockProbe) else probe.times)
+
+        if not times:
+            continue
+
+        print(f"{name:<20}{len(times):>8}{sum(times):>10.2f}"
+              f"{percentile(times, 0.5) * 1000:>10.2f}{percentile(times, 0.99) * 1000:>10.2f}"
+              f"{times[-1] * 1000:>10.2f}")
+
+    if sampler.samples:
+        print(f"{'threads':<20}{'peak':>8}{max(sampler.samples):>10}")
+
+    return True
+
+
+def run(dispatcher, updates: List[dict], rate: float, threads: int) -> List[float]:
+    # Send the updates at the target rate, return the end-to-end latency of each update
+    from telegram import Update
+
+    bot = dispatcher.bot
+    latencies = [0.0] * len(updates)
+    start = perf_counter()
+
+    def process(i: int, scheduled: float, update: Update):
+        dispatcher.process_update(update)
+        latencies[i] = perf_counter() - scheduled
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for i, data in enumerate(updates):
+            scheduled = start + i / rate
+            delay = scheduled - perf_counter()
+            delay > 0 and sleep(delay)
+            executor.submit(process, i, scheduled, Update.de_json(data, bot))
+
+    return latencies
+
+
+def main(args: Optional[List[str]] = None):
+    parser = ArgumentParser(description="Drive the handlers with synthetic spam waves against a fake Bot API")
+    parser.add_argument("--groups", type=int, default=100, help="number of groups")
+    parser.add_argument("--users", type=int, default=2000, help="number of regular users")
+    parser.add_argument("--rate", type=float, default=200.0, help="target updates per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    parser.add_argument("--threads", type=int, default=4, help="concurrent dispatcher threads")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated Bot API latency in seconds")
+    parser.add_argument("--mix", default="", help="traffic mix in percent, such as chatter=70,long=10")
+    parser.add_argument("--nospam", action="store_true", help="NOSPAM is an admin of the groups")
+    args = parser.parse_args(args)
+
+    total = int(args.rate * args.duration)
+    updates = get_traffic(total, args.groups, args.users, get_mix(args.mix))
+    prepare()
+
+    api = FakeApi(args.latency)
+    recorder = Recorder()
+    dispatcher = get_dispatcher(api, recorder)
+    seed_groups(updates, args.nospam)
+    probes = install_probes()
+
+    sampler = ThreadSampler()
+    sampler.start()
+    baseline = active_count()
+    start = perf_counter()
+    latencies = run(dispatcher, updates, args.rate, args.threads)
+    secs = perf_counter() - start
+    settle = wait_threads(baseline)
+    sampler.stop()
+
+    print(f"target: {args.rate:.0f} updates/s, achieved: {len(updates) / secs:.0f} updates/s, "
+          f"outbound threads settled in {settle:.2f}s")
+    print()
+    print(f"{'quarter':<20}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+    size = max(1, len(latencies) // 4)
+
+    for i in range(4):
+        part = sorted(latencies[i * size:(i + 1) * size])
+
+        if not part:
+            continue
+
+        print(f"{i + 1:<20}{percentile(part, 0.5) * 1000:>10.2f}{percentile(part, 0.9) * 1000:>10.2f}"
+              f"{percentile(part, 0.99) * 1000:>10.2f}{part[-1] * 1000:>10.2f}")
+
+    print_probes(probes, sampler)
+    print()
+    print_report(len(updates), secs, recorder, api)
+
+
+if __name__ == "__main__":
+    main()
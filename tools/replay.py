@@ -0,0 +1,266 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Replay recorded updates through the real handlers against a local fake Bot API:
+#
+#     python -m tools.replay updates.jsonl --latency 0.05 --threads 4
+#
+# Each line of the capture is an update as returned by getUpdates.
+
+import logging
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from json import loads
+from threading import Lock, active_count
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tools.fake import FakeApi, FakeRequest, config_ids, prepare, token
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Bot API methods that carry a moderation decision
+decision_methods: List[str] = ["deleteMessage", "forwardMessage", "kickChatMember", "leaveChat",
+                               "restrictChatMember", "unbanChatMember"]
+
+
+class Recorder:
+    # Record the latency of each handler callback
+    def __init__(self):
+        self.times: Dict[str, List[float]] = {}
+        self.lock = Lock()
+
+    def add(self, name: str, secs: float):
+        with self.lock:
+            self.times.setdefault(name, []).append(secs)
+
+    def wrap(self, callback: Callable) -> Callable:
+        name = callback.__name__
+
+        def wrapped(update, context):
+            start = perf_counter()
+
+            try:
+                return callback(update, context)
+            finally:
+                self.add(name, perf_counter() - start)
+
+        wrapped.__name__ = name
+
+        return wrapped
+
+
+def get_decisions(api: FakeApi) -> Tuple[Dict[str, int], Dict[str, int]]:
+    # Get the moderation calls and the data shared to the exchange channel
+    methods = {}
+    exchange = {}
+    exchange_ids = {config_ids["channels"]["exchange_channel_id"], config_ids["channels"]["hide_channel_id"]}
+
+    for _, method, params in list(api.calls):
+        if method in decision_methods:
+            methods[method] = methods.get(method, 0) + 1
+
+        if method not in {"sendMessage", "sendDocument"} or int(params.get("chat_id", 0) or 0) not in exchange_ids:
+            continue
+
+        text = params.get("text") or params.get("caption") or ""
+        text = unescape(re.sub(r"</?pre>", "", text))
+
+        try:
+            data = loads(text)
+            key = f"{data['action']} {data['type']}"
+            exchange[key] = exchange.get(key, 0) + 1
+        except ValueError:
+            continue
+
+    return methods, exchange
+
+
+def get_dispatcher(api: FakeApi, recorder: Recorder):
+    # Get a dispatcher with the real handlers and a fake Bot
+    from queue import Queue
+
+    from telegram import Bot
+    from telegram.ext import Dispatcher
+
+    from plugins.functions.ids import rebuild_trusted_ids, rebuild_user_ids, rebuild_watch_heap
+    from plugins.functions.route import init_routes
+    from plugins.handlers.command import add_command_handlers
+    from plugins.handlers.error import add_error_handlers
+    from plugins.handlers.message import add_message_handlers
+
+    rebuild_trusted_ids()
+    rebuild_user_ids()
+    rebuild_watch_heap()
+    init_routes()
+
+    bot = Bot(token=token, request=FakeRequest(api))
+    dispatcher = Dispatcher(bot, Queue(), workers=1, use_context=True)
+    add_command_handlers(dispatcher)
+    add_message_handlers(dispatcher)
+    add_error_handlers(dispatcher)
+
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            handler.callback = recorder.wrap(handler.callback)
+
+    return dispatcher
+
+
+def load_updates(path: str, limit: int = 0) -> List[dict]:
+    # Load the recorded updates
+    updates = []
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            updates.append(loads(line))
+
+            if limit and len(updates) >= limit:
+                break
+
+    return updates
+
+
+def percentile(values: List[float], p: float) -> float:
+    # Get the percentile of sorted values
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def print_report(total: int, secs: float, recorder: Recorder, api: FakeApi) -> bool:
+    # Print the throughput, the latency of each handler and the decisions
+    print(f"updates: {total} in {secs:.2f}s, {total / max(secs, 1e-9):.0f} updates/s")
+    print()
+    print(f"{'handler':<20}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+    for name, times in sorted(recorder.times.items()):
+        times = sorted(times)
+        print(f"{name:<20}{len(times):>8}"
+              f"{percentile(times, 0.5) * 1000:>10.2f}{percentile(times, 0.9) * 1000:>10.2f}"
+              f"{percentile(times, 0.99) * 1000:>10.2f}{times[-1] * 1000:>10.2f}")
+
+    methods, exchange = get_decisions(api)
+    print()
+    print("decisions:")
+
+    for method, count in sorted(methods.items()):
+        print(f"    {method:<30}{count:>8}")
+
+    print("exchange:")
+
+    for key, count in sorted(exchange.items()):
+        print(f"    {key:<30}{count:>8}")
+
+    print("api calls:")
+
+    for method, count in sorted(api.count().items()):
+        print(f"    {method:<30}{count:>8}")
+
+    return True
+
+
+def replay(dispatcher, updates: List[dict], threads: int = 1) -> float:
+    # Feed the updates to the dispatcher, return the time it took
+    from telegram import Update
+
+    bot = dispatcher.bot
+    start = perf_counter()
+
+    if threads <= 1:
+        for data in updates:
+            dispatcher.process_update(Update.de_json(data, bot))
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for data in updates:
+                executor.submit(dispatcher.process_update, Update.de_json(data, bot))
+
+    return perf_counter() - start
+
+
+def seed_groups(updates: List[dict], nospam: bool = False) -> int:
+    # Make the bot an admin of the recorded groups
+    from plugins import glovar
+    from plugins.functions.ids import init_group_id
+
+    gids = set()
+
+    for data in updates:
+        message = data.get("message") or data.get("edited_message") or {}
+        chat = message.get("chat", {})
+
+        if chat.get("type") in {"group", "supergroup"}:
+            gids.add(chat["id"])
+
+    for gid in gids:
+        if not init_group_id(gid):
+            continue
+
+        glovar.admin_ids[gid] = {1, glovar.long_id, glovar.user_id}
+        nospam and glovar.admin_ids[gid].add(glovar.nospam_id)
+
+    return len(gids)
+
+
+def wait_threads(baseline: int, timeout: float = 30.0) -> float:
+    # Wait for the outbound threads to finish
+    start = time()
+
+    while active_count() > baseline and time() - start < timeout:
+        sleep(0.05)
+
+    return time() - start
+
+
+def main(args: Optional[List[str]] = None):
+    parser = ArgumentParser(description="Replay recorded updates through the handlers against a fake Bot API")
+    parser.add_argument("path", help="JSONL file, one update per line")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API latency in seconds")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most this many updates")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent dispatcher threads")
+    parser.add_argument("--nospam", action="store_true", help="NOSPAM is an admin of the recorded groups")
+    parser.add_argument("--no-seed", action="store_true", help="do not make the bot an admin of the groups")
+    args = parser.parse_args(args)
+
+    updates = load_updates(args.path, args.limit)
+    prepare()
+
+    api = FakeApi(args.latency)
+    recorder = Recorder()
+    dispatcher = get_dispatcher(api, recorder)
+    groups = 0 if args.no_seed else seed_groups(updates, args.nospam)
+    print(f"groups: {groups}")
+
+    baseline = active_count()
+    secs = replay(dispatcher, updates, args.threads)
+    settle = wait_threads(baseline)
+    print(f"outbound threads settled in {settle:.2f}s")
+    print_report(len(updates), secs, recorder, api)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run the router and the shards on one machine against a local fake Bot API:
+#
+#     python -m tools.shards --shards 3 --groups 60 --rate 200 --duration 10
+#
+# Each shard is a separate process with its own working directory and data.
+# The report shows the updates and groups of each shard, checks that no group
+# is served by two shards, and counts the exchange data synced between shards.
+
+import logging
+import sys
+from argparse import ArgumentParser
+from json import dumps, loads
+from os import makedirs
+from os.path import join
+from random import randint
+from socket import socket
+from subprocess import PIPE, Popen
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, List, Optional
+
+from tools.fake import FakeApi, FakeServer, prepare, root, token
+from tools.load import get_mix, get_traffic
+from tools.replay import Recorder, get_decisions, get_dispatcher, seed_groups
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_overrides(shards: int, index: int, port: int) -> Dict[str, Dict[str, str]]:
+    # Get the shard settings of config.ini
+    return {
+        "shard": {
+            "count": str(shards),
+            "index": str(index),
+            "listen": "127.0.0.1",
+            "port": str(port)
+        }
+    }
+
+
+def get_ports(number: int) -> int:
+    # Get a base port followed by free ports
+    while True:
+        base = randint(20000, 60000 - number)
+
+        try:
+            for port in range(base, base + number):
+                with socket() as s:
+                    s.bind(("127.0.0.1", port))
+
+            return base
+        except OSError:
+            continue
+
+
+def run_shard(args) -> None:
+    # Run a shard until its stdin is closed, then print its report as JSON
+    from telegram import Update
+
+    prepare(join(args.root, f"shard-{args.worker}"), get_overrides(args.shards, args.worker, args.port))
+
+    from plugins.functions.shard import start_shard
+
+    updates = get_traffic(int(args.rate * args.duration), args.groups, args.users, get_mix(args.mix))
+
+    api = FakeApi(args.latency)
+    recorder = Recorder()
+    dispatcher = get_dispatcher(api, recorder)
+    seed_groups(updates, args.nospam)
+
+    stats = {"updates": 0, "groups": set(), "synced": 0}
+    lock = Lock()
+    process_update = dispatcher.process_update
+
+    def counted(update):
+        if isinstance(update, Update) and update.effective_chat:
+            with lock:
+                stats["updates"] += 1
+
+                if update.effective_chat.type == "channel":
+                    stats["synced"] += '"from": "LONG"' in (update.effective_message.text or "")
+                else:
+                    stats["groups"].add(update.effective_chat.id)
+
+        return process_update(update)
+
+    dispatcher.process_update = counted
+    start_shard(dispatcher)
+    print("ready", flush=True)
+    sys.stdin.read()
+    sleep(1)
+
+    methods, exchange = get_decisions(api)
+    print(dumps({
+        "updates": stats["updates"],
+        "groups": sorted(stats["groups"]),
+        "synced": stats["synced"],
+        "decisions": methods,
+        "exchange": exchange
+    }), flush=True)
+
+
+def start_router(port: int, shards: int) -> FakeApi:
+    # Start the router in this process, against a fake Bot API served over HTTP
+    from telegram import Bot
+    from telegram.utils.request import Request
+
+    prepare(mkdtemp(prefix="long-router-"), get_overrides(shards, 0, port))
+
+    from plugins.functions.shard import run_router
+
+    api = FakeApi()
+    server = FakeServer(api)
+    server.start()
+    bot = Bot(token=token, base_url=server.base_url, request=Request(con_pool_size=4, read_timeout=20))
+    t = Thread(target=run_router, args=(bot,), daemon=True)
+    t.start()
+
+    return api
+
+
+def main(args: Optional[List[str]] = None):
+    parser = ArgumentParser(description="Run the router and the shards on one machine against a fake Bot API")
+    parser.add_argument("--shards", type=int, default=3, help="number of shard processes")
+    parser.add_argument("--groups", type=int, default=60, help="number of groups")
+    parser.add_argument("--users", type=int, default=2000, help="number of regular users")
+    parser.add_argument("--rate", type=float, default=200.0, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API latency of the shards")
+    parser.add_argument("--mix", default="", help="traffic mix in percent, such as chatter=70,long=10")
+    parser.add_argument("--nospam", action="store_true", help="NOSPAM is an admin of the groups")
+    parser.add_argument("--worker", type=int, default=-1, help="internal: run this shard")
+    parser.add_argument("--port", type=int, default=0, help="internal: the port of the router")
+    parser.add_argument("--root", default="", help="internal: the directory of the shards")
+    args = parser.parse_args(args)
+
+    if args.worker >= 0:
+        return run_shard(args)
+
+    path = mkdtemp(prefix="long-shards-")
+    port = get_ports(args.shards + 1)
+    workers = []
+
+    for index in range(args.shards):
+        makedirs(join(path, f"shard-{index}"))
+        command = [sys.executable, "-m", "tools.shards", "--worker", str(index), "--port", str(port),
+                   "--root", path, "--shards", str(args.shards), "--groups", str(args.groups),
+                   "--users", str(args.users), "--rate", str(args.rate), "--duration", str(args.duration),
+                   "--latency", str(args.latency), "--mix", args.mix]
+        args.nospam and command.append("--nospam")
+        worker = Popen(command, cwd=root, stdin=PIPE, stdout=PIPE, universal_newlines=True)
+        workers.append(worker)
+
+    for worker in workers:
+        worker.stdout.readline()
+
+    api = start_router(port, args.shards)
+    updates = get_traffic(int(args.rate * args.duration), args.groups, args.users, get_mix(args.mix))
+
+    for i in range(0, len(updates), max(1, int(args.rate / 10))):
+        api.add_updates(updates[i:i + max(1, int(args.rate / 10))])
+        sleep(0.1)
+
+    # Wait for the router to hand out the rest
+    sleep(3)
+
+    reports = []
+
+    for index, worker in enumerate(workers):
+        output, _ = worker.communicate("")
+        lines = output.strip().splitlines()
+
+        if not lines or not lines[-1].startswith("{"):
+            raise SystemExit(f"Shard {index} exited without a report")
+
+        reports.append(loads(lines[-1]))
+
+    owners: Dict[int, int] = {}
+
+    print(f"{'shard':<10}{'updates':>10}{'groups':>10}{'synced':>10}  decisions")
+
+    for index, report in enumerate(reports):
+        for gid in report["groups"]:
+            owners[gid] = owners.get(gid, 0) + 1
+
+        print(f"{index:<10}{report['updates']:>10}{len(report['groups']):>10}{report['synced']:>10}  "
+              f"{report['decisions']}")
+
+    print()
+    print(f"updates sent: {len(updates)}, groups: {len(owners)}, "
+          f"groups served by more than one shard: {sum(1 for count in owners.values() if count > 1)}")
+
+
+if __name__ == "__main__":
+    main()